@@ -0,0 +1,109 @@
+import contextlib
+import io
+import sys
+import tarfile
+import time
+import typing
+import zipfile
+
+from CompileOptions import CompileOptions
+from FileHandler import compile_source
+from VMCode import reset_names
+
+# The input path that stands for a tar archive streamed on stdin.
+STDIN = '-'
+
+
+def read_sources(input_path: str) -> typing.Iterator[typing.Tuple[str, bytes]]:
+    """
+    Read the .jack files of an archive one at a time, without extracting them.
+    :param input_path: a tar archive, possibly compressed, a zip archive, or '-' for a tar archive on stdin.
+    :return: the name and the source of every .jack file, in the order of the archive.
+    """
+    if input_path != STDIN and zipfile.is_zipfile(input_path):
+        with zipfile.ZipFile(input_path) as archive:
+            for name in archive.namelist():
+                if name[-5:] == '.jack':
+                    yield name, archive.read(name)
+        return
+    if input_path == STDIN:
+        archive = tarfile.open(fileobj=sys.stdin.buffer, mode='r|*')
+    else:
+        archive = tarfile.open(input_path, mode='r|*')
+    with archive:
+        for member in archive:
+            if member.isfile() and member.name[-5:] == '.jack':
+                yield member.name, archive.extractfile(member).read()
+
+
+class BatchCompiler:
+    """
+    Compile many .jack files held in an archive in a single process, streaming their .vm files to a tar archive as
+    each one is compiled. Nothing is read from or written to the filesystem besides the archives.
+    """
+
+    def __init__(self, options: CompileOptions):
+        """
+        Create a new batch compiler.
+        :param options: options to compile every file with.
+        """
+        self.__options = options
+        self.__compiled = 0
+        self.__failed = 0
+
+    def get_compiled(self) -> int:
+        """
+        :return: the number of files compiled so far, including those that failed.
+        """
+        return self.__compiled
+
+    def get_failed(self) -> int:
+        """
+        :return: the number of files that failed to compile so far.
+        """
+        return self.__failed
+
+    def run(self, input_path: str, output: typing.BinaryIO) -> bool:
+        """
+        Compile every .jack file of an archive, and write the .vm file of every file that compiled successfully to
+        a tar archive. Errors are printed to stderr with the name of their file.
+        :param input_path: the archive to read, as in read_sources.
+        :param output: a binary stream, such as the buffer of sys.stdout, that the tar archive is written to.
+        :return: whether all the files compiled successfully.
+        """
+        with tarfile.open(fileobj=output, mode='w|') as results:
+            for name, source in read_sources(input_path):
+                code = self.__compile(name, source)
+                if code is None:
+                    continue
+                data = code.encode()
+                info = tarfile.TarInfo(name[:-5] + '.vm')
+                info.size = len(data)
+                info.mtime = int(time.time())
+                results.addfile(info, io.BytesIO(data))
+                output.flush()
+        return self.__failed == 0
+
+    def __compile(self, name: str, source: bytes) -> typing.Optional[str]:
+        """
+        Compile a single file, capturing anything the compiler prints so it does not mix with the archive.
+        :return: the VM code of the file, or None if it failed to compile.
+        """
+        self.__compiled += 1
+        reset_names()
+        output = io.StringIO()
+        error = None
+        code = None
+        with contextlib.redirect_stdout(output):
+            try:
+                code = compile_source(source, self.__options)
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+        if output.getvalue():
+            print(output.getvalue(), end='', file=sys.stderr)
+            error = error or 'failed to compile'
+        if error is not None:
+            print(f'{name}: {error}', file=sys.stderr)
+            self.__failed += 1
+            return None
+        return code
@@ -0,0 +1,212 @@
+"""
+A program that benchmarks the compiler on a generated corpus of jack classes.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import typing
+
+from CorpusGenerator import CorpusGenerator
+from Parser import Parser
+from Tokenizer import Tokenizer
+from VMWriter import VMWriter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+COMPILER_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT = 'benchmark.json'
+STAGES = ['tokenizer', 'parser', 'vm_writer', 'end_to_end']
+# A stage whose time grows faster than the size of the corpus to this power is reported as not scaling.
+SCALING_WARNING_EXPONENT = 1.3
+
+
+def run_tokenizer(paths: typing.List[str]) -> int:
+    """
+    Read every token of the files.
+    :return: the number of tokens.
+    """
+    count = 0
+    for path in paths:
+        tokenizer = Tokenizer(path, prelex=True)
+        while tokenizer.has_more_tokens():
+            tokenizer.next_token()
+            count += 1
+        tokenizer.close()
+    return count
+
+
+def run_parser(paths: typing.List[str]):
+    """
+    Parse the files into parse trees, keeping their VM code in memory.
+    """
+    for path in paths:
+        tokenizer = Tokenizer(path, prelex=True)
+        Parser(tokenizer, build_tree=True).parse()
+        tokenizer.close()
+
+
+def run_vm_writer(paths: typing.List[str]):
+    """
+    Compile the files without parse trees, streaming their VM code into memory.
+    """
+    for path in paths:
+        tokenizer = Tokenizer(path, prelex=True)
+        Parser(tokenizer, build_tree=False, vm_writer=VMWriter(io.StringIO())).parse()
+        tokenizer.close()
+
+
+def run_end_to_end(directory: str) -> int:
+    """
+    Compile a directory with the compiler's command line, as a new process.
+    :return: the peak memory of the process in bytes, or 0 if it cannot be measured.
+    """
+    subprocess.run([sys.executable, os.path.join(COMPILER_DIR, 'JackCompiler.py'), '--force', directory],
+                   check=True, stdout=subprocess.DEVNULL)
+    if resource is None:
+        return 0
+    # The maximum over all waited-for children, which is the largest compilation so far. Linux reports kilobytes.
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def best_time(function: typing.Callable[[], typing.Any], repeats: int) -> float:
+    """
+    :return: the shortest wall time of several calls to a function, in seconds.
+    """
+    best = math.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_memory(function: typing.Callable[[], typing.Any]) -> int:
+    """
+    :return: the peak memory allocated by Python during a call to a function, in bytes.
+    """
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_corpus(directory: str, paths: typing.List[str], repeats: int) -> typing.Dict[str, typing.Any]:
+    """
+    Time every stage of the compiler on a corpus.
+    :param directory: the directory of the corpus.
+    :param paths: paths of the .jack files of the corpus.
+    :param repeats: number of times to run each stage, the fastest run is reported.
+    :return: the sizes of the corpus and the results of each stage.
+    """
+    lines = 0
+    size = 0
+    for path in paths:
+        with open(path) as file:
+            text = file.read()
+        lines += text.count('\n')
+        size += len(text)
+    tokens = run_tokenizer(paths)
+    functions = {
+        'tokenizer': lambda: run_tokenizer(paths),
+        'parser': lambda: run_parser(paths),
+        'vm_writer': lambda: run_vm_writer(paths),
+    }
+    stages = {}
+    for stage, function in functions.items():
+        seconds = best_time(function, repeats)
+        stages[stage] = {'seconds': seconds, 'tokens_per_second': tokens / seconds,
+                         'lines_per_second': lines / seconds, 'peak_memory_bytes': peak_memory(function)}
+    end_to_end_memory = 0
+    seconds = math.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        end_to_end_memory = run_end_to_end(directory)
+        seconds = min(seconds, time.perf_counter() - start)
+    stages['end_to_end'] = {'seconds': seconds, 'tokens_per_second': tokens / seconds,
+                            'lines_per_second': lines / seconds, 'peak_memory_bytes': end_to_end_memory}
+    return {'files': len(paths), 'lines': lines, 'bytes': size, 'tokens': tokens, 'stages': stages}
+
+
+def scaling_exponents(results: typing.List[typing.Dict[str, typing.Any]]) -> typing.Dict[str, typing.List[float]]:
+    """
+    Estimate how the time of each stage grows with the size of the corpus. An exponent of 1 is linear growth, and
+    an exponent near 2 is quadratic.
+    :param results: results of corpora of increasing sizes.
+    :return: for each stage, the exponent between every two consecutive corpora.
+    """
+    exponents = {stage: [] for stage in STAGES}
+    for smaller, larger in zip(results, results[1:]):
+        size_ratio = larger['tokens'] / smaller['tokens']
+        for stage in STAGES:
+            time_ratio = larger['stages'][stage]['seconds'] / smaller['stages'][stage]['seconds']
+            exponents[stage].append(math.log(time_ratio) / math.log(size_ratio))
+    return exponents
+
+
+def commit_id() -> typing.Optional[str]:
+    """
+    :return: the git commit of the compiler, or None if it is not in a git repository.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=COMPILER_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description='Benchmark the compiler on generated .jack classes.')
+    arg_parser.add_argument('-o', '--output', default=DEFAULT_OUTPUT, help='the JSON file to write the results to')
+    arg_parser.add_argument('--classes', type=int, default=4, help='number of classes in the corpus')
+    arg_parser.add_argument('--subroutines', type=int, default=20, help='number of subroutines in each class')
+    arg_parser.add_argument('--expression-depth', type=int, default=3, help='nesting depth of expressions')
+    arg_parser.add_argument('--string-length', type=int, default=40, help='length of string constants')
+    arg_parser.add_argument('--comment-lines', type=int, default=4, help='comment lines before each subroutine')
+    arg_parser.add_argument('--var-count', type=int, default=8, help='local variables of each subroutine')
+    arg_parser.add_argument('--scales', default='1,2,4',
+                            help='comma separated multipliers of the number of subroutines, each benchmarked on '
+                                 'its own corpus to check that the compiler scales linearly')
+    arg_parser.add_argument('--repeats', type=int, default=3, help='runs of each stage, the fastest is reported')
+    arg_parser.add_argument('--seed', type=int, default=0, help='seed of the corpus generator')
+    args = arg_parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(',')]
+    results = []
+    for scale in scales:
+        generator = CorpusGenerator(args.subroutines * scale, args.expression_depth, args.string_length,
+                                    args.comment_lines, args.var_count, args.seed)
+        with tempfile.TemporaryDirectory() as directory:
+            result = benchmark_corpus(directory, generator.write(directory, args.classes), args.repeats)
+        result['scale'] = scale
+        result['corpus'] = generator.describe()
+        results.append(result)
+        print(f'scale {scale}: {result["lines"]} lines, {result["tokens"]} tokens')
+        for stage in STAGES:
+            timing = result['stages'][stage]
+            print(f'  {stage:<11} {timing["seconds"]:8.3f}s {timing["tokens_per_second"]:12.0f} tokens/s '
+                  f'{timing["lines_per_second"]:10.0f} lines/s {timing["peak_memory_bytes"] / 2 ** 20:8.1f} MiB')
+
+    exponents = scaling_exponents(results)
+    for stage, stage_exponents in exponents.items():
+        if any(exponent > SCALING_WARNING_EXPONENT for exponent in stage_exponents):
+            print(f'Warning: {stage} grows faster than linearly: exponents '
+                  f'{", ".join(f"{exponent:.2f}" for exponent in stage_exponents)}.', file=sys.stderr)
+    report = {'commit': commit_id(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'classes': args.classes, 'repeats': args.repeats, 'seed': args.seed, 'results': results,
+              'scaling_exponents': exponents}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
@@ -0,0 +1,127 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import typing
+
+MANIFEST_FILE = '.jackcache'
+VERSION = 'version'
+OPTIONS = 'options'
+FILES = 'files'
+SOURCE = 'source'
+OUTPUT = 'output'
+
+_compiler_version = None
+
+
+def compiler_version() -> str:
+    """
+    :return: a hash of the compiler's own sources, so that changing the compiler invalidates every cached output.
+    """
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha1()
+        for module in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+            with open(module, 'rb') as file:
+                digest.update(file.read())
+        _compiler_version = digest.hexdigest()
+    return _compiler_version
+
+
+def sources_hash(source_dir: str, file_list: typing.List[str]) -> str:
+    """
+    :return: a hash of the names and contents of source files, for outputs that depend on all of them.
+    """
+    digest = hashlib.sha1()
+    for source_file in sorted(file_list):
+        with open(os.path.join(source_dir, source_file), 'rb') as file:
+            digest.update(source_file.encode() + b'\0' + hashlib.sha1(file.read()).digest())
+    return digest.hexdigest()
+
+
+class BuildCache:
+    """
+    A manifest of the .jack files of a directory, keyed by content hash, recording which .vm outputs are up to date.
+    """
+
+    def __init__(self, source_dir: str, options: str = ''):
+        """
+        Load the manifest of a source directory.
+        :param source_dir: directory of the .jack files and their .vm outputs.
+        :param options: description of the compiler options, outputs compiled with other options are not reused.
+        """
+        self.__source_dir = source_dir
+        self.__manifest_file = os.path.join(source_dir, MANIFEST_FILE)
+        self.__version = compiler_version()
+        self.__options = options
+        self.__files = {}
+        self.__source_hashes = {}
+        self.__changed = False
+        try:
+            with open(self.__manifest_file, 'r') as file:
+                manifest = json.load(file)
+        except (OSError, ValueError):
+            return
+        if manifest.get(VERSION) == self.__version and manifest.get(OPTIONS) == self.__options:
+            self.__files = manifest.get(FILES, {})
+
+    def __source_hash(self, source_file: str) -> str:
+        if source_file not in self.__source_hashes:
+            with open(os.path.join(self.__source_dir, source_file), 'rb') as file:
+                self.__source_hashes[source_file] = hashlib.sha1(file.read()).hexdigest()
+        return self.__source_hashes[source_file]
+
+    def __output_stamp(self, source_file: str) -> typing.Optional[typing.List[int]]:
+        try:
+            stat = os.stat(os.path.join(self.__source_dir, source_file[:-5] + '.vm'))
+        except OSError:
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def is_up_to_date(self, source_file: str) -> bool:
+        """
+        :param source_file: name of a .jack file in the source directory.
+        :return: whether the file's .vm output was compiled from the same source, compiler and options.
+        """
+        entry = self.__files.get(source_file)
+        return (entry is not None and entry[SOURCE] == self.__source_hash(source_file)
+                and entry[OUTPUT] == self.__output_stamp(source_file))
+
+    def update(self, source_file: str):
+        """
+        Record that a .jack file was just compiled successfully.
+        """
+        self.__files[source_file] = {SOURCE: self.__source_hash(source_file), OUTPUT: self.__output_stamp(source_file)}
+        self.__changed = True
+
+    def clear(self):
+        """
+        Forget every recorded output, so that every file is recompiled.
+        """
+        self.__files = {}
+        self.__changed = True
+
+    def invalidate(self, source_file: str):
+        """
+        Record that a .jack file has no valid output.
+        """
+        if self.__files.pop(source_file, None) is not None:
+            self.__changed = True
+
+    def save(self):
+        """
+        Atomically write the manifest back to the source directory, if it changed.
+        """
+        if not self.__changed:
+            return
+        manifest = {VERSION: self.__version, OPTIONS: self.__options, FILES: self.__files}
+        fd, temp_name = tempfile.mkstemp(dir=self.__source_dir or '.', prefix=MANIFEST_FILE)
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(manifest, file, indent=1, sort_keys=True)
+            os.replace(temp_name, self.__manifest_file)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+        self.__changed = False
@@ -0,0 +1,38 @@
+class CompileOptions:
+    """
+    Options that control how .jack files are compiled.
+    """
+
+    def __init__(self, peephole: bool = False, fold_constants: bool = False, string_pool: bool = False,
+                 optimize_control_flow: bool = False, whole_program: bool = False,
+                 inline_size: int = 0, optimize_arrays: bool = False, xml: bool = False):
+        """
+        Create a new set of compile options.
+        :param peephole: run the peephole optimizer over the generated VM code.
+        :param fold_constants: evaluate constant operations at compile time and strength-reduce multiplications.
+        :param string_pool: build each distinct string literal of a class once, and reuse it afterwards.
+        :param optimize_control_flow: lay out if and while statements without negated conditions, drop branches
+            that cannot run, and simplify jumps in the generated VM code.
+        :param whole_program: compile the files as a single program, and drop the subroutines that its entry point
+            never calls.
+        :param inline_size: in whole program mode, replace calls to leaf subroutines of at most this many commands
+            with their code, 0 to never inline.
+        :param optimize_arrays: address array elements with constant indices through the that segment, and set
+            pointer 1 before the right hand side of an array assignment that cannot change it, instead of going
+            through temp 0.
+        :param xml: also write the parse tree of each file to an .xml file next to it, streaming it as it is parsed.
+        """
+        self.peephole = peephole
+        self.fold_constants = fold_constants
+        self.string_pool = string_pool
+        self.optimize_control_flow = optimize_control_flow
+        self.whole_program = whole_program
+        self.inline_size = inline_size
+        self.optimize_arrays = optimize_arrays
+        self.xml = xml
+
+    def describe(self) -> str:
+        """
+        :return: a description of the options, for telling apart outputs compiled with different options.
+        """
+        return ','.join(f'{name}={value}' for name, value in sorted(vars(self).items()))
@@ -0,0 +1,150 @@
+import contextlib
+import sys
+import time
+import typing
+
+from Tokenizer import Tokenizer, Token
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The phases of compiling a file. Files that are tokenized over a memory map are lexed lazily, so their lexing is
+# counted in the parse phase.
+READ = 'read'
+LEX = 'lex'
+PARSE = 'parse'
+WRITE = 'write'
+PHASES = [READ, LEX, PARSE, WRITE]
+
+
+def peak_memory() -> int:
+    """
+    :return: the peak resident memory of this process so far in bytes, or 0 if it cannot be measured.
+    """
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, and macOS reports bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class FileStats:
+    """
+    Statistics of compiling a single .jack file. They are only collected when asked for, so compiling without them
+    costs nothing.
+    """
+
+    def __init__(self, file_name: str):
+        """
+        Create empty statistics for a file.
+        :param file_name: name of the .jack file.
+        """
+        self.file_name = file_name
+        self.phase_seconds = {phase: 0.0 for phase in PHASES}
+        self.tokens = 0
+        self.next_token_calls = 0
+        self.peek_calls = 0
+        self.vm_commands = 0
+        self.peak_memory = 0
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """
+        Add the wall time of a block of code to a phase.
+        :param name: the phase.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] += time.perf_counter() - start
+
+    def add(self, other: 'FileStats'):
+        """
+        Add the statistics of another file to these, the peak memory being the larger of the two.
+        """
+        for phase, seconds in other.phase_seconds.items():
+            self.phase_seconds[phase] += seconds
+        self.tokens += other.tokens
+        self.next_token_calls += other.next_token_calls
+        self.peek_calls += other.peek_calls
+        self.vm_commands += other.vm_commands
+        self.peak_memory = max(self.peak_memory, other.peak_memory)
+
+    def describe(self) -> str:
+        """
+        :return: a single line describing the statistics.
+        """
+        phases = ' '.join(f'{phase} {seconds:.3f}s' for phase, seconds in self.phase_seconds.items())
+        return f'{self.file_name}: {phases}, {self.tokens} tokens, {self.next_token_calls} next_token calls, ' \
+               f'{self.peek_calls} peek calls, {self.vm_commands} VM commands, ' \
+               f'peak memory {self.peak_memory / 2 ** 20:.1f} MiB'
+
+
+class CountingTokenizer(Tokenizer):
+    """
+    A tokenizer that times reading and lexing its file, and counts the calls made to it.
+    """
+
+    def __init__(self, source_file: typing.Optional[str], stats: FileStats, prelex: bool = False,
+                 memory_map: bool = False, source: typing.Union[str, bytes, None] = None):
+        """
+        Create a counting tokenizer stream over an input file.
+        :param source_file: input file
+        :param stats: the statistics to record into.
+        :param prelex: lex the whole file up front instead of lexing tokens as they are needed.
+        :param memory_map: match tokens directly against a read-only memory map of the file.
+        :param source: the jack source itself, to tokenize it without reading a file.
+        """
+        self.__stats = stats
+        with stats.phase(READ):
+            super().__init__(source_file, memory_map=memory_map, source=source)
+        if prelex:
+            with stats.phase(LEX):
+                self.prelex()
+
+    # Every call made to the tokenizer is counted once: eat as a next_token call, and has_more_tokens as a peek
+    # call. The methods of the tokenizer do not call each other through these, so they are not counted again.
+
+    def next_token(self, cut=True) -> typing.Optional[Token]:
+        self.__stats.next_token_calls += 1
+        token = super().next_token(cut)
+        if cut and token is not None:
+            self.__stats.tokens += 1
+        return token
+
+    def eat(self, string: str):
+        self.__stats.next_token_calls += 1
+        self.__stats.tokens += 1
+        super().eat(string)
+
+    def peek(self, k: int = 1) -> typing.Optional[Token]:
+        self.__stats.peek_calls += 1
+        return super().peek(k)
+
+    def has_more_tokens(self) -> bool:
+        self.__stats.peek_calls += 1
+        return super().has_more_tokens()
+
+
+class TimedSink:
+    """
+    A text sink that times the writes to another sink, and counts the VM commands written to it.
+    """
+
+    def __init__(self, sink: typing.TextIO, stats: FileStats):
+        """
+        Create a timed sink.
+        :param sink: the sink to write to.
+        :param stats: the statistics to record into.
+        """
+        self.__sink = sink
+        self.__stats = stats
+
+    def write(self, text: str) -> int:
+        # The VMWriter separates the commands it writes with newlines, including between two writes.
+        self.__stats.vm_commands += text.count('\n') + (0 if text.startswith('\n') else 1)
+        with self.__stats.phase(WRITE):
+            return self.__sink.write(text)
@@ -0,0 +1,195 @@
+import typing
+
+from VMCode import PUSH, NOT, NEG, ADD, TEMP, OPCODE_MASK, push, pop, push_constant, constant_of
+
+POP_TEMP = pop(TEMP, 0)
+PUSH_TEMP = push(TEMP, 0)
+POP_PRODUCT = pop(TEMP, 1)
+PUSH_PRODUCT = push(TEMP, 1)
+MAX_CONSTANT = 32767
+# Multiplications by constants with more set bits than this are still left to Math.multiply.
+MAX_MULTIPLIER_BITS = 4
+
+
+def to_word(value: int) -> int:
+    """
+    :return: the value wrapped around to a signed 16-bit word, like the Hack ALU does.
+    """
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def divide(left: int, right: int) -> int:
+    """
+    :return: the quotient rounded toward zero, like Math.divide.
+    """
+    quotient = abs(left) // abs(right)
+    return to_word(quotient if (left < 0) == (right < 0) else -quotient)
+
+
+BINARY_OPS = {
+    '+': lambda left, right: to_word(left + right),
+    '-': lambda left, right: to_word(left - right),
+    '*': lambda left, right: to_word(left * right),
+    '/': divide,
+    '&': lambda left, right: left & right,
+    '|': lambda left, right: left | right,
+    '<': lambda left, right: -1 if left < right else 0,
+    '>': lambda left, right: -1 if left > right else 0,
+    '=': lambda left, right: -1 if left == right else 0,
+}
+
+
+class ConstantFolder:
+    """
+    Evaluate binary operations on constants at compile time, and replace multiplications and divisions by constants
+    with cheaper code. Operands are evaluated strictly left to right, so an operation is only rewritten when its
+    operands are its own terms, never by reassociating a longer expression.
+    """
+
+    def __init__(self):
+        """
+        Create a new constant folder.
+        """
+        self.__folded = 0
+
+    def get_folded(self) -> int:
+        """
+        :return: the number of operations that were folded or reduced so far.
+        """
+        return self.__folded
+
+    @staticmethod
+    def constant_value(code: typing.List[int], start: int = 0, end: typing.Optional[int] = None) \
+            -> typing.Optional[int]:
+        """
+        :param code: VM commands that include the code of a term.
+        :param start: the index in code where the code of the term starts.
+        :param end: the index in code where the code of the term ends, the end of code if not given.
+        :return: the value of the term if it is a constant, such as 'push constant 5' followed by 'neg', else None.
+            Only the commands up to the first one that is not part of a constant are looked at.
+        """
+        if end is None:
+            end = len(code)
+        value = constant_of(code[start]) if start < end else None
+        if value is None:
+            return None
+        for index in range(start + 1, end):
+            line = code[index]
+            if line == NEG:
+                value = to_word(-value)
+            elif line == NOT:
+                value = to_word(~value)
+            else:
+                return None
+        return value
+
+    @staticmethod
+    def constant_code(value: int) -> typing.List[int]:
+        """
+        :return: the shortest VM commands that push a constant.
+        """
+        if value >= 0:
+            return [push_constant(value)]
+        if value == -1 or value == -MAX_CONSTANT - 1:
+            return [push_constant(~value), NOT]
+        return [push_constant(-value), NEG]
+
+    @staticmethod
+    def __multiply_code(operand: typing.Optional[int], multiplier: int) -> typing.List[int]:
+        """
+        Multiply by a positive constant with shifts and adds, doubling left to right over the bits of the multiplier.
+        :param operand: the command of the value to multiply if it is a single push, else None.
+        :param multiplier: the constant, at least 2.
+        :return: VM commands that compute the product after the code of the value to multiply.
+        """
+        if operand is not None:
+            # A single push has no side effects, so it can simply be repeated.
+            code = []
+            push_operand = operand
+        else:
+            code = [POP_TEMP, PUSH_TEMP]
+            push_operand = PUSH_TEMP
+        first = True
+        for bit in bin(multiplier)[3:]:
+            if first:
+                code += [push_operand, ADD]
+                first = False
+            else:
+                code += [POP_PRODUCT, PUSH_PRODUCT, PUSH_PRODUCT, ADD]
+            if bit == '1':
+                code += [push_operand, ADD]
+        return code
+
+    def __fold_constant_operand(self, op: str, operand: typing.Optional[int], constant: int,
+                                is_right: bool) -> typing.Optional[typing.Tuple[bool, typing.List[int]]]:
+        """
+        Simplify an operation where one operand is a constant.
+        :param op: the operator.
+        :param operand: the command of the other operand if it is a single push, else None.
+        :param constant: the value of the constant operand.
+        :param is_right: whether the constant is the right operand.
+        :return: whether the code of the other operand is kept, and the VM commands that follow it or replace it to
+            compute the result, or None if there is no simplification.
+        """
+        if (op in '+|' and constant == 0) or (op == '-' and is_right and constant == 0) \
+                or (op == '&' and constant == -1) or (op == '*' and constant == 1) \
+                or (op == '/' and is_right and constant == 1):
+            return True, []
+        if (op == '*' and constant == -1) or (op == '/' and is_right and constant == -1) \
+                or (op == '-' and not is_right and constant == 0):
+            return True, [NEG]
+        if op in '*&' and constant == 0:
+            if operand is not None:
+                return False, self.constant_code(0)
+            return True, [POP_TEMP] + self.constant_code(0)
+        if op == '*' and 2 <= abs(constant) <= MAX_CONSTANT and bin(constant).count('1') <= MAX_MULTIPLIER_BITS:
+            code = self.__multiply_code(operand, abs(constant))
+            return True, code + [NEG] if constant < 0 else code
+        return None
+
+    @staticmethod
+    def __single_push(lines: typing.List[int], start: int, end: int) -> typing.Optional[int]:
+        """
+        :return: the command of the code from start to end if it is a single push, else None.
+        """
+        return lines[start] if end - start == 1 and lines[start] & OPCODE_MASK == PUSH else None
+
+    def fold(self, lines: typing.List[int], op: str, left: int, right: int) -> bool:
+        """
+        Try to replace the code of a binary operation with cheaper code. The code of an operand that is not a
+        constant is left in place rather than copied, so folding nested operations takes linear time.
+        :param lines: the VM commands written so far, ending with the code of both operands.
+        :param op: the operator.
+        :param left: the index in lines where the code of the left operand starts.
+        :param right: the index in lines where the code of the right operand starts.
+        :return: whether the operation was folded, in which case lines was rewritten and the operator must not be
+            written.
+        """
+        left_value = self.constant_value(lines, left, right)
+        right_value = self.constant_value(lines, right)
+        if left_value is not None and right_value is not None:
+            if op == '/' and right_value == 0:
+                return False
+            lines[left:] = self.constant_code(BINARY_OPS[op](left_value, right_value))
+        elif right_value is not None:
+            folded = self.__fold_constant_operand(op, self.__single_push(lines, left, right), right_value, True)
+            if folded is None:
+                return False
+            keep, code = folded
+            lines[right if keep else left:] = code
+        elif left_value is not None:
+            folded = self.__fold_constant_operand(op, self.__single_push(lines, right, len(lines)), left_value,
+                                                  False)
+            if folded is None:
+                return False
+            keep, code = folded
+            if keep:
+                del lines[left:right]
+                lines += code
+            else:
+                lines[left:] = code
+        else:
+            return False
+        self.__folded += 1
+        return True
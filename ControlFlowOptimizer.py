@@ -0,0 +1,215 @@
+import typing
+
+from VMCode import PUSH, POP, CALL, GOTO, IF_GOTO, LABEL, FUNCTION, RETURN, NOT, NEG, LT, GT, EQ, AND, OR, \
+    OPCODE_MASK, command, push_constant, constant_of, argument_of, operand_of, with_opcode, jump_target
+
+PUSH_FALSE = push_constant(0)
+MAX_CONSTANT = 32767
+# Operations on two values whose result is a boolean, and whether it is a boolean only if both values are.
+COMPARISONS = {LT, GT, EQ}
+BITWISE_OPS = {AND, OR}
+
+
+def is_boolean(code: typing.List[int], start: int = 0, end: typing.Optional[int] = None) -> bool:
+    """
+    Check whether VM commands compute a boolean, that is either 0 or -1. Only booleans may be jumped on directly:
+    a condition is true only if it is -1, while 'if-goto' jumps on any value that is not 0.
+    :param code: VM commands that include the code of a value.
+    :param start: the index in code where the code of the value starts.
+    :param end: the index in code where the code of the value ends, the end of code if not given.
+    :return: whether the value is known to be a boolean.
+    """
+    stack = []
+    for index in range(start, len(code) if end is None else end):
+        line = code[index]
+        opcode = line & OPCODE_MASK
+        if opcode == PUSH:
+            stack.append(line == PUSH_FALSE)
+        elif opcode == POP and stack:
+            stack.pop()
+        elif opcode == NOT and stack:
+            pass
+        elif (opcode in COMPARISONS or opcode in BITWISE_OPS) and len(stack) >= 2:
+            right = stack.pop()
+            left = stack.pop()
+            stack.append(opcode in COMPARISONS or (left and right))
+        elif opcode == CALL and len(stack) >= argument_of(line):
+            del stack[len(stack) - argument_of(line):]
+            stack.append(False)
+        elif opcode == FUNCTION or opcode == LABEL or jump_target(line) is not None or not stack:
+            return False
+        else:
+            # Any other operation on one or two values, such as 'add' or 'neg'.
+            arguments = 1 if opcode == NEG else 2
+            if len(stack) < arguments:
+                return False
+            del stack[len(stack) - arguments:]
+            stack.append(False)
+    return len(stack) == 1 and stack[0]
+
+
+def negate_condition(code: typing.List[int], start: int = 0) -> bool:
+    """
+    Negate a boolean condition in place without adding a 'not' command. Only its last two commands are changed.
+    :param code: VM commands that end with the code of the condition.
+    :param start: the index in code where the code of the condition starts.
+    :return: whether the condition was negated. If it cannot be negated this way, code is left unchanged.
+    """
+    if len(code) > start and code[-1] == NOT and is_boolean(code, start, len(code) - 1):
+        del code[-1]
+        return True
+    constant = constant_of(code[-2]) if len(code) - start >= 2 else None
+    if constant is not None:
+        # ~(x < c) is x > c - 1, and ~(x > c) is x < c + 1.
+        if code[-1] == LT and constant > 0:
+            code[-2:] = [push_constant(constant - 1), GT]
+            return True
+        if code[-1] == GT and constant < MAX_CONSTANT:
+            code[-2:] = [push_constant(constant + 1), LT]
+            return True
+    return False
+
+
+class ControlFlowOptimizer:
+    """
+    Simplify the jumps of VM code: thread jumps to unconditional jumps, remove jumps to the next command, remove
+    code that can never run and unused labels, and negate conditions instead of jumping around a jump.
+    """
+
+    def __init__(self):
+        """
+        Create a new control flow optimizer.
+        """
+        self.__removed = 0
+
+    def get_removed(self) -> int:
+        """
+        :return: the number of commands removed by all the calls to optimize so far.
+        """
+        return self.__removed
+
+    def optimize(self, lines: typing.List[int]) -> typing.List[int]:
+        """
+        Optimize the VM commands of a subroutine until no more jumps can be simplified.
+        :param lines: the VM commands to optimize.
+        :return: the optimized VM commands.
+        """
+        original_length = len(lines)
+        while True:
+            optimized = self.__remove_unreachable(self.__thread_jumps(self.__invert_branches(lines)))
+            if optimized == lines:
+                break
+            lines = optimized
+        self.__removed += original_length - len(lines)
+        return lines
+
+    @staticmethod
+    def __invert_branches(lines: typing.List[int]) -> typing.List[int]:
+        """
+        Rewrite 'if-goto A', 'goto B', 'label A' into a jump to B on the negated condition, where the condition is a
+        comparison with a constant that can be negated for free. Also negate such comparisons that are followed by
+        'not'.
+        """
+        output = []
+        index = 0
+        while index < len(lines):
+            line = lines[index]
+            if line & OPCODE_MASK == IF_GOTO and index + 2 < len(lines) and lines[index + 1] & OPCODE_MASK == GOTO \
+                    and lines[index + 2] == with_opcode(line, LABEL):
+                if output and output[-1] in (LT, GT) and negate_condition(output, max(len(output) - 2, 0)):
+                    output.append(with_opcode(lines[index + 1], IF_GOTO))
+                    index += 2
+                    continue
+            if line == NOT and output and output[-1] in (LT, GT) \
+                    and negate_condition(output, max(len(output) - 2, 0)):
+                index += 1
+                continue
+            output.append(line)
+            index += 1
+        return output
+
+    @staticmethod
+    def __thread_jumps(lines: typing.List[int]) -> typing.List[int]:
+        """
+        Retarget jumps to labels that are followed by a goto, and remove gotos to labels that directly follow them.
+        """
+        # The goto that every label is followed by, past any other labels, and the index of the first label of the
+        # consecutive labels that every label is one of. Both are found in one pass, so long runs of labels, such as
+        # the end labels of nested if statements, are not scanned again for each of their labels.
+        forwards = {}
+        label_runs = {}
+        following = len(lines)
+        for index in range(len(lines) - 1, -1, -1):
+            line = lines[index]
+            if line & OPCODE_MASK == LABEL:
+                if following < len(lines) and lines[following] & OPCODE_MASK == GOTO:
+                    forwards[operand_of(line)] = operand_of(lines[following])
+            else:
+                following = index
+        run_start = None
+        for index, line in enumerate(lines):
+            if line & OPCODE_MASK == LABEL:
+                if run_start is None:
+                    run_start = index
+                label_runs[operand_of(line)] = run_start
+            else:
+                run_start = None
+
+        # The final target of every label on a chain of gotos that was followed, so long chains, such as the end
+        # labels of nested else-if statements, are followed once.
+        targets = {}
+
+        def final_target(label: int) -> int:
+            path = []
+            seen = set()
+            while label not in targets:
+                path.append(label)
+                seen.add(label)
+                following = forwards.get(label)
+                if following is None:
+                    break
+                if following in seen:
+                    # A cycle of gotos is followed up to the label it would repeat, which depends on where it is
+                    # entered, so it is not recorded.
+                    return label
+                label = following
+            final = targets.get(label, label)
+            for passed in path:
+                targets[passed] = final
+            return final
+
+        output = []
+        for index, line in enumerate(lines):
+            target = jump_target(line)
+            if target is not None:
+                target = final_target(target)
+                opcode = line & OPCODE_MASK
+                line = command(opcode, 0, target)
+                if opcode == GOTO and label_runs.get(target) == index + 1:
+                    # The target is one of the labels that directly follow the goto.
+                    continue
+            output.append(line)
+        return output
+
+    @staticmethod
+    def __remove_unreachable(lines: typing.List[int]) -> typing.List[int]:
+        """
+        Remove commands after a goto or a return that no jump leads to, and labels that no jump leads to.
+        """
+        used_labels = {jump_target(line) for line in lines} - {None}
+        output = []
+        reachable = True
+        for line in lines:
+            opcode = line & OPCODE_MASK
+            if opcode == LABEL:
+                if operand_of(line) in used_labels:
+                    reachable = True
+                    output.append(line)
+            elif opcode == FUNCTION:
+                reachable = True
+                output.append(line)
+            elif reachable:
+                output.append(line)
+                if opcode == GOTO or line == RETURN:
+                    reachable = False
+        return output
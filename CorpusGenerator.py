@@ -0,0 +1,134 @@
+import os
+import random
+import typing
+
+# Characters of generated string constants and comments. Jack strings cannot contain quotes or newlines, and there
+# is no '*' so a comment never ends early.
+TEXT_CHARS = 'abcdefghijklmnopqrstuvwxyz ABCDEFGHIJKLMNOPQRSTUVWXYZ 0123456789 .,:;!?-+/()[]{}'
+BINARY_OPS = '+-*/&|<>='
+
+
+class CorpusGenerator:
+    """
+    Generate synthetic jack classes of a configurable size and shape, to benchmark the compiler with.
+    """
+
+    def __init__(self, subroutines: int = 20, expression_depth: int = 3, string_length: int = 40,
+                 comment_lines: int = 4, var_count: int = 8, seed: int = 0):
+        """
+        Create a new corpus generator.
+        :param subroutines: number of subroutines in each class.
+        :param expression_depth: how deeply the expressions of each subroutine are nested.
+        :param string_length: length of the string constants.
+        :param comment_lines: number of comment lines before each subroutine.
+        :param var_count: number of local variables declared by each subroutine, which are also its var list.
+        :param seed: seed of the random generator, the same seed always generates the same classes.
+        """
+        self.__subroutines = subroutines
+        self.__expression_depth = expression_depth
+        self.__string_length = string_length
+        self.__comment_lines = comment_lines
+        self.__var_count = max(var_count, 1)
+        self.__random = random.Random(seed)
+
+    def describe(self) -> typing.Dict[str, int]:
+        """
+        :return: the parameters of the generator.
+        """
+        return {'subroutines': self.__subroutines, 'expression_depth': self.__expression_depth,
+                'string_length': self.__string_length, 'comment_lines': self.__comment_lines,
+                'var_count': self.__var_count}
+
+    def __text(self, length: int) -> str:
+        return ''.join(self.__random.choice(TEXT_CHARS) for _ in range(length))
+
+    def __term(self, depth: int, variables: typing.List[str], callees: typing.List[str]) -> str:
+        choice = self.__random.random()
+        if depth <= 0 or choice < 0.3:
+            if self.__random.random() < 0.5:
+                return str(self.__random.randint(0, 32767))
+            return self.__random.choice(variables)
+        if choice < 0.45:
+            return self.__random.choice('-~') + self.__term(depth - 1, variables, callees)
+        if choice < 0.6 and callees:
+            return f'{self.__random.choice(callees)}({self.__expression(depth - 1, variables, callees)}, ' \
+                   f'{self.__expression(depth - 1, variables, callees)})'
+        if choice < 0.7:
+            return f'a[{self.__expression(depth - 1, variables, callees)}]'
+        return f'({self.__expression(depth - 1, variables, callees)})'
+
+    def __expression(self, depth: int, variables: typing.List[str], callees: typing.List[str]) -> str:
+        expression = self.__term(depth, variables, callees)
+        for _ in range(self.__random.randint(1, 3)):
+            expression += f' {self.__random.choice(BINARY_OPS)} {self.__term(depth, variables, callees)}'
+        return expression
+
+    def __comment(self) -> typing.List[str]:
+        if not self.__comment_lines:
+            return []
+        lines = ['    /**']
+        lines += [f'     * {self.__text(60)}' for _ in range(self.__comment_lines - 1)]
+        lines.append('     */')
+        return lines
+
+    def __subroutine(self, class_name: str, index: int) -> typing.List[str]:
+        variables = [f'v{i}' for i in range(self.__var_count)]
+        callees = [f'{class_name}.f{i}' for i in range(index)]
+        depth = self.__expression_depth
+        lines = self.__comment()
+        lines.append(f'    function int f{index}(int p, int q) {{')
+        lines.append(f'        var int {", ".join(variables)};')
+        lines.append('        var Array a;')
+        lines.append('        var String s;')
+        lines.append('        let a = Array.new(8);')
+        lines.append(f'        let s = "{self.__text(self.__string_length)}"; // {self.__text(20)}')
+        for variable in variables:
+            lines.append(f'        let {variable} = {self.__expression(depth, ["p", "q"], callees)};')
+        lines.append(f'        if ({self.__expression(depth, variables, callees)}) {{')
+        lines.append(f'            let v0 = {self.__expression(depth, variables, callees)};')
+        lines.append('        } else {')
+        lines.append(f'            let a[1] = {self.__expression(depth, variables, callees)};')
+        lines.append('        }')
+        lines.append('        while (v0 < 10) {')
+        lines.append(f'            let v0 = v0 + 1;  /* {self.__text(20)} */')
+        lines.append('            do Output.printInt(v0);')
+        lines.append('        }')
+        lines.append('        do Output.printString(s);')
+        lines.append('        do s.dispose();')
+        lines.append('        do a.dispose();')
+        lines.append(f'        return {self.__expression(depth, variables, callees)};')
+        lines.append('    }')
+        lines.append('')
+        return lines
+
+    def generate_class(self, class_name: str) -> str:
+        """
+        Generate the source code of a single class.
+        :param class_name: name of the class.
+        :return: the jack source of the class.
+        """
+        lines = [f'// {self.__text(60)}' for _ in range(self.__comment_lines)]
+        lines.append(f'class {class_name} {{')
+        lines.append('    static int count;')
+        lines.append('    field int x, y;')
+        lines.append('')
+        for index in range(self.__subroutines):
+            lines += self.__subroutine(class_name, index)
+        lines.append('}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, directory: str, class_count: int) -> typing.List[str]:
+        """
+        Generate classes into .jack files.
+        :param directory: the directory to write the files to.
+        :param class_count: number of classes to generate.
+        :return: paths of the generated files.
+        """
+        paths = []
+        for index in range(class_count):
+            class_name = f'Class{index}'
+            path = os.path.join(directory, class_name + '.jack')
+            with open(path, 'w') as file:
+                file.write(self.generate_class(class_name))
+            paths.append(path)
+        return paths
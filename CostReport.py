@@ -0,0 +1,148 @@
+import io
+import typing
+
+from HackWriter import HackWriter
+from VMCode import PUSH, POP, ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT, GOTO, IF_GOTO, FUNCTION, CALL, RETURN, \
+    OPCODE_MASK, name_of
+
+PUSH_KIND = 'push'
+POP_KIND = 'pop'
+ARITHMETIC_KIND = 'arith'
+CALL_KIND = 'call'
+BRANCH_KIND = 'branch'
+KINDS = (PUSH_KIND, POP_KIND, ARITHMETIC_KIND, CALL_KIND, BRANCH_KIND)
+# The kind of every counted command. Returns are counted with calls, and labels and function declarations are not
+# counted.
+OPCODE_KINDS = {PUSH: PUSH_KIND, POP: POP_KIND, CALL: CALL_KIND, RETURN: CALL_KIND, GOTO: BRANCH_KIND,
+                IF_GOTO: BRANCH_KIND}
+OPCODE_KINDS.update((opcode, ARITHMETIC_KIND) for opcode in (ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT))
+OS_CLASSES = {'Array', 'Keyboard', 'Math', 'Memory', 'Output', 'Screen', 'String', 'Sys'}
+# Columns of the table of describe, after the name of the function.
+COLUMNS = ('cycles',) + KINDS
+
+
+class FunctionCost:
+    """
+    The static cost of the VM code of a single function: its commands by kind, its calls to the OS, and an estimate
+    of the Hack instructions that running each of its commands once takes.
+    """
+
+    def __init__(self, name: str):
+        """
+        Create an empty cost for a function.
+        :param name: full name of the function, such as Main.main.
+        """
+        self.name = name
+        self.kind_counts = {kind: 0 for kind in KINDS}
+        self.os_calls = {}
+        self.cycles = 0
+
+    def count(self, code: typing.Sequence[int]):
+        """
+        Count the commands of the function and estimate their cycles by lowering them to Hack assembly.
+        :param code: the VM commands of the function, starting with its declaration.
+        """
+        for line in code:
+            opcode = line & OPCODE_MASK
+            kind = OPCODE_KINDS.get(opcode)
+            if kind is not None:
+                self.kind_counts[kind] += 1
+            if opcode == CALL:
+                callee = name_of(line)
+                if callee.split('.', 1)[0] in OS_CLASSES:
+                    self.os_calls[callee] = self.os_calls.get(callee, 0) + 1
+        writer = HackWriter(io.StringIO())
+        writer.write_class(self.name.split('.', 1)[0], code)
+        self.cycles = writer.get_instruction_count() + writer.get_routine_instructions()
+
+    def to_json(self) -> typing.Dict[str, typing.Any]:
+        """
+        :return: the cost as a JSON object.
+        """
+        return {'name': self.name, 'cycles': self.cycles, 'commands': dict(self.kind_counts),
+                'os_calls': dict(sorted(self.os_calls.items()))}
+
+
+class CostReport:
+    """
+    The static cost of the VM code of many functions, such as those of a program, attributed to each function.
+    Cycles are estimated as the Hack instructions, including those of the shared call, return and comparison
+    routines, that running every command of a function once takes, so loops are not accounted for.
+    """
+
+    def __init__(self):
+        """
+        Create an empty cost report.
+        """
+        self.__functions = {}
+
+    def add(self, code: typing.Sequence[int]):
+        """
+        Add the costs of the functions of some VM code, such as a flushed subroutine.
+        :param code: VM commands, with a function declaration before the commands of every function.
+        """
+        start = None
+        for index, line in enumerate(code):
+            if line & OPCODE_MASK == FUNCTION:
+                if start is not None:
+                    self.__add_function(code[start:index])
+                start = index
+        if start is not None:
+            self.__add_function(code[start:])
+
+    def __add_function(self, code: typing.Sequence[int]):
+        cost = FunctionCost(name_of(code[0]))
+        cost.count(code)
+        self.__functions[cost.name] = cost
+
+    def merge(self, other: 'CostReport'):
+        """
+        Add the costs of the functions of another report to this one.
+        """
+        self.__functions.update((cost.name, cost) for cost in other.get_functions())
+
+    def get_functions(self) -> typing.List[FunctionCost]:
+        """
+        :return: the cost of every function, the most expensive first.
+        """
+        return sorted(self.__functions.values(), key=lambda cost: (-cost.cycles, cost.name))
+
+    def get_os_calls(self) -> typing.Dict[str, int]:
+        """
+        :return: the number of calls to every OS function from all the functions, the most called first.
+        """
+        os_calls = {}
+        for cost in self.__functions.values():
+            for callee, count in cost.os_calls.items():
+                os_calls[callee] = os_calls.get(callee, 0) + count
+        return dict(sorted(os_calls.items(), key=lambda item: (-item[1], item[0])))
+
+    def describe(self, limit: typing.Optional[int] = None) -> str:
+        """
+        :param limit: the number of the most expensive functions to describe, all of them if not given.
+        :return: tables of the costs of the functions and of the calls to the OS, as lines of text.
+        """
+        functions = self.get_functions()[:limit]
+        width = max([len('function')] + [len(cost.name) for cost in functions])
+        lines = [f'{"function":<{width}} ' + ' '.join(f'{column:>7}' for column in COLUMNS) + '  OS calls']
+        for cost in functions:
+            os_calls = ', '.join(f'{callee} {count}' for callee, count in sorted(cost.os_calls.items()))
+            lines.append(f'{cost.name:<{width}} {cost.cycles:>7} '
+                         + ' '.join(f'{cost.kind_counts[kind]:>7}' for kind in KINDS) + f'  {os_calls}'.rstrip())
+        os_calls = self.get_os_calls()
+        if os_calls:
+            width = max(len(callee) for callee in os_calls)
+            lines.append('')
+            lines.append(f'{"OS function":<{width}}   calls')
+            lines += [f'{callee:<{width}} {count:>7}' for callee, count in os_calls.items()]
+        return '\n'.join(lines)
+
+    def to_json(self) -> typing.Dict[str, typing.Any]:
+        """
+        :return: the report as a JSON object, with the functions the most expensive first.
+        """
+        functions = self.get_functions()
+        return {'functions': [cost.to_json() for cost in functions],
+                'total': {'cycles': sum(cost.cycles for cost in functions),
+                          'commands': {kind: sum(cost.kind_counts[kind] for cost in functions) for kind in KINDS},
+                          'os_calls': self.get_os_calls()}}
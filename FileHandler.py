@@ -1,7 +1,42 @@
+import contextlib
+import io
 import os
+import typing
 
+from CompileOptions import CompileOptions
+from CostReport import CostReport
+from CompileStats import FileStats, CountingTokenizer, TimedSink, PARSE, WRITE, peak_memory
+from ConstantFolder import ConstantFolder
+from ControlFlowOptimizer import ControlFlowOptimizer
 from Parser import Parser
+from PeepholeOptimizer import PeepholeOptimizer
+from SubroutineCache import SubroutineCache
 from Tokenizer import Tokenizer
+from VMWriter import VMWriter
+from XmlStream import XmlStream
+
+# Files at least this large are tokenized over a memory map, with bounded memory, instead of being read and lexed
+# up front.
+MEMORY_MAP_THRESHOLD = 1 << 23
+# The name that sources compiled from memory are known by, as if they were read from a file.
+SOURCE_NAME = 'Source.jack'
+
+
+def replace_file(file_name: str, text: str):
+    """
+    Atomically replace the contents of a file, writing them to a temporary file first.
+    :param file_name: the file to replace.
+    :param text: the new contents.
+    """
+    temp_file_name = f'{file_name}.{os.getpid()}.tmp'
+    try:
+        with open(temp_file_name, 'w') as file:
+            file.write(text)
+        os.replace(temp_file_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_file_name):
+            os.remove(temp_file_name)
+        raise
 
 
 class FileHandler:
@@ -9,22 +44,169 @@ class FileHandler:
     A class that handles the parsing and compilation of .jack files.
     """
 
-    def __init__(self, source_file, source_dir):
+    def __init__(self, source_file, source_dir, build_tree=False, options: CompileOptions = None,
+                 stats: FileStats = None, subroutine_cache: SubroutineCache = None,
+                 source: typing.Union[str, bytes, None] = None, cost_report: CostReport = None):
         """
         Create a new file handler for a specific .jack file.
         :param source_file:
         :param source_dir:
+        :param build_tree: whether to also build the parse tree of the file, which is dumped on errors.
+        :param options: options to compile with, the defaults if not given.
+        :param stats: statistics to record the compilation into, if they should be collected.
+        :param subroutine_cache: the subroutines of the previous compilation of the file, to reuse the code of those
+            that did not change. It is not used with a parse tree, with XML output or with a string pool.
+        :param source: the jack source of the file, to compile it without reading the file. The .vm file is still
+            named after the .jack file.
+        :param cost_report: a report to add the cost of every subroutine of the file to.
         """
-        self.__tokenizer = Tokenizer(os.path.join(source_dir, source_file))
-        self.__parser = Parser(self.__tokenizer)
+        self.__options = options if options is not None else CompileOptions()
+        self.__optimizer = PeepholeOptimizer() if self.__options.peephole else None
+        self.__folder = ConstantFolder() if self.__options.fold_constants else None
+        self.__flow_optimizer = ControlFlowOptimizer() if self.__options.optimize_control_flow else None
+        self.__stats = stats
+        self.__cost_report = cost_report
+        self.__subroutine_cache = None
+        if subroutine_cache is not None and not build_tree and not self.__options.xml \
+                and not self.__options.string_pool:
+            self.__subroutine_cache = subroutine_cache
+            subroutine_cache.start()
+        source_path = os.path.join(source_dir, source_file)
+        memory_map = source is None and os.path.getsize(source_path) >= MEMORY_MAP_THRESHOLD
+        if stats is not None:
+            self.__tokenizer = CountingTokenizer(source_path, stats, prelex=not memory_map, memory_map=memory_map,
+                                                 source=source)
+        else:
+            self.__tokenizer = Tokenizer(source_path, prelex=not memory_map, memory_map=memory_map, source=source)
+        self.__build_tree = build_tree
         self.__target_file_name = os.path.join(source_dir, source_file[:-5] + '.vm')
+        self.__xml_file_name = os.path.join(source_dir, source_file[:-5] + '.xml') if self.__options.xml else None
 
     def compile(self):
         """
-        compile the .jack file and output the xml result into the relevant file.
+        compile the .jack file into the relevant .vm file. The code is written to a temporary file as each
+        subroutine is compiled, which then atomically replaces the .vm file.
         :return:
         """
-        lines = self.__parser.parse()
-        # element_tree.write(self.__target_file_name, pretty_print=True)
-        with open(self.__target_file_name, 'w') as file:
-            file.write('\n'.join(lines))
+        temp_file_name = f'{self.__target_file_name}.{os.getpid()}.tmp'
+        try:
+            with open(temp_file_name, 'w') as file:
+                self.compile_to(file)
+            if self.__stats is not None:
+                with self.__stats.phase(WRITE):
+                    os.replace(temp_file_name, self.__target_file_name)
+            else:
+                os.replace(temp_file_name, self.__target_file_name)
+        except BaseException:
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+            raise
+
+    def compile_to(self, sink: typing.TextIO):
+        """
+        compile the .jack file, writing the VM code to a text stream one subroutine at a time.
+        :param sink: a text stream such as an open file, sys.stdout or io.StringIO.
+        :return:
+        """
+        if self.__stats is not None:
+            self.__compile_with_stats(sink)
+            return
+        vm_writer = VMWriter(sink, self.__optimizer, self.__folder, self.__options.string_pool, self.__flow_optimizer,
+                             self.__cost_report)
+        with self.__open_xml_stream() as xml_stream:
+            parser = Parser(self.__tokenizer, self.__build_tree, vm_writer, self.__options, self.__subroutine_cache,
+                            xml_stream)
+            try:
+                parser.parse()
+            finally:
+                self.__tokenizer.close()
+
+    def compile_code(self) -> typing.List[int]:
+        """
+        compile the .jack file, keeping the VM code in memory instead of writing it.
+        :return: the VM commands of the file.
+        """
+        vm_writer = VMWriter(None, self.__optimizer, self.__folder, self.__options.string_pool, self.__flow_optimizer,
+                             self.__cost_report)
+        with self.__open_xml_stream() as xml_stream:
+            parser = Parser(self.__tokenizer, self.__build_tree, vm_writer, self.__options, self.__subroutine_cache,
+                            xml_stream)
+            try:
+                if self.__stats is not None:
+                    with self.__stats.phase(PARSE):
+                        return parser.parse()
+                return parser.parse()
+            finally:
+                self.__tokenizer.close()
+
+    def __compile_with_stats(self, sink: typing.TextIO):
+        """
+        compile the .jack file like compile_to, timing the parse and write phases.
+        """
+        stats = self.__stats
+        timed_sink = TimedSink(sink, stats)
+        vm_writer = VMWriter(timed_sink, self.__optimizer, self.__folder, self.__options.string_pool,
+                             self.__flow_optimizer, self.__cost_report)
+        write_seconds = stats.phase_seconds[WRITE]
+        with self.__open_xml_stream() as xml_stream:
+            parser = Parser(self.__tokenizer, self.__build_tree, vm_writer, self.__options, self.__subroutine_cache,
+                            xml_stream)
+            try:
+                with stats.phase(PARSE):
+                    parser.parse()
+            finally:
+                self.__tokenizer.close()
+        # The parser drives the writes, so their time is taken out of the parse phase.
+        stats.phase_seconds[PARSE] -= stats.phase_seconds[WRITE] - write_seconds
+        stats.peak_memory = peak_memory()
+
+    @contextlib.contextmanager
+    def __open_xml_stream(self) -> typing.Iterator[typing.Optional[XmlStream]]:
+        """
+        Open a stream to the .xml file of the parse tree if the options ask for it. Like the .vm file, it is written to
+        a temporary file, which replaces the .xml file once the whole tree was written.
+        :return: a context manager of the stream, or of None without XML output.
+        """
+        if self.__xml_file_name is None:
+            yield None
+            return
+        temp_file_name = f'{self.__xml_file_name}.{os.getpid()}.tmp'
+        try:
+            with XmlStream(temp_file_name) as xml_stream:
+                yield xml_stream
+            os.replace(temp_file_name, self.__xml_file_name)
+        except BaseException:
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+            raise
+
+    def get_removed(self) -> int:
+        """
+        :return: the number of VM commands removed by the peephole and control flow optimizers.
+        """
+        removed = 0
+        if self.__optimizer is not None:
+            removed += self.__optimizer.get_removed()
+        if self.__flow_optimizer is not None:
+            removed += self.__flow_optimizer.get_removed()
+        return removed
+
+
+def compile_source(source: typing.Union[str, bytes], options: CompileOptions = None) -> str:
+    """
+    Compile jack source held in memory, without reading or writing any file.
+    :param source: the jack source of a class.
+    :param options: options to compile with, the defaults if not given.
+    :return: the VM code of the class, as commands separated by newlines.
+    """
+    sink = io.StringIO()
+    FileHandler(SOURCE_NAME, '', options=options, source=source).compile_to(sink)
+    return sink.getvalue()
+
+
+def compile_source_code(source: typing.Union[str, bytes], options: CompileOptions = None) -> typing.List[int]:
+    """
+    Compile jack source held in memory, like compile_source.
+    :return: the VM commands of the class.
+    """
+    return FileHandler(SOURCE_NAME, '', options=options, source=source).compile_code()
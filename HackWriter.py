@@ -0,0 +1,351 @@
+import typing
+
+from VMCode import PUSH, POP, ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT, LABEL, GOTO, IF_GOTO, FUNCTION, CALL, \
+    RETURN, CONSTANT, ARGUMENT, LOCAL, STATIC, THIS, THAT, POINTER, TEMP, OPCODE_MASK, argument_of, operand_of, \
+    name_of, constant_of
+
+STACK_START = 256
+TEMP_START = 5
+# Registers the shared routines pass their values in.
+R13 = 'R13'
+R14 = 'R14'
+R15 = 'R15'
+# The base pointers of the segments that are addressed through them.
+BASE_POINTERS = {LOCAL: 'LCL', ARGUMENT: 'ARG', THIS: 'THIS', THAT: 'THAT'}
+POINTERS = ('THIS', 'THAT')
+# Segments below this index are reached by stepping the address up from the base pointer, instead of adding it.
+MAX_STEPS = 3
+# The Hack computations of the binary operations, with the right operand in D and the left one in M.
+BINARY_COMPUTATIONS = {ADD: 'D=D+M', SUB: 'D=M-D', AND: 'D=D&M', OR: 'D=D|M'}
+UNARY_COMPUTATIONS = {NEG: 'D=-D', NOT: 'D=!D'}
+# The jump that is taken when a comparison holds, and when it does not, given the left operand minus the right one.
+COMPARISON_JUMPS = {EQ: ('JEQ', 'JNE'), LT: ('JLT', 'JGE'), GT: ('JGT', 'JLE')}
+# Names of the shared routines. '$' cannot appear in Jack identifiers, so they never clash with user code.
+CALL_ROUTINE = '$call'
+RETURN_ROUTINE = '$return'
+COMPARE_ROUTINES = {LT: '$lt', GT: '$gt'}
+HALT_LABEL = '$halt'
+
+CALL_ROUTINE_CODE = [
+    # D is the return address, R13 the number of arguments and R14 the address of the function.
+    f'({CALL_ROUTINE})', '@SP', 'A=M', 'M=D',
+    '@LCL', 'D=M', '@SP', 'AM=M+1', 'M=D',
+    '@ARG', 'D=M', '@SP', 'AM=M+1', 'M=D',
+    '@THIS', 'D=M', '@SP', 'AM=M+1', 'M=D',
+    '@THAT', 'D=M', '@SP', 'AM=M+1', 'M=D',
+    '@SP', 'MD=M+1', '@LCL', 'M=D',
+    '@R13', 'D=D-M', '@5', 'D=D-A', '@ARG', 'M=D',
+    '@R14', 'A=M', '0;JMP',
+]
+RETURN_ROUTINE_CODE = [
+    # D is the return value. The return address is read first, since the value may be written over it.
+    f'({RETURN_ROUTINE})', '@R13', 'M=D',
+    '@LCL', 'D=M', '@5', 'A=D-A', 'D=M', '@R14', 'M=D',
+    '@R13', 'D=M', '@ARG', 'A=M', 'M=D',
+    '@ARG', 'D=M+1', '@SP', 'M=D',
+    '@LCL', 'AM=M-1', 'D=M', '@THAT', 'M=D',
+    '@LCL', 'AM=M-1', 'D=M', '@THIS', 'M=D',
+    '@LCL', 'AM=M-1', 'D=M', '@ARG', 'M=D',
+    '@LCL', 'A=M-1', 'D=M', '@LCL', 'M=D',
+    '@R14', 'A=M', '0;JMP',
+]
+
+
+# The number of instructions that a jump to each shared routine runs, the longest path for the comparisons.
+CALL_ROUTINE_INSTRUCTIONS = sum(1 for line in CALL_ROUTINE_CODE if not line.startswith('('))
+RETURN_ROUTINE_INSTRUCTIONS = sum(1 for line in RETURN_ROUTINE_CODE if not line.startswith('('))
+COMPARE_ROUTINE_INSTRUCTIONS = 20
+
+
+def compare_routine_code(opcode: int) -> typing.List[str]:
+    """
+    :return: the shared routine of a comparison. It is called with the left operand in D, the right one in R13 and
+    the return address in R14, and returns the result in D. Operands of different signs are compared by their signs,
+    since subtracting them may overflow.
+    """
+    name = COMPARE_ROUTINES[opcode]
+    # The result when the left operand is negative and the right one is not, and the other way around.
+    left_negative, right_negative = ('-1', '0') if opcode == LT else ('0', '-1')
+    holds, _ = COMPARISON_JUMPS[opcode]
+    return [
+        f'({name})', '@R15', 'M=D', f'@{name}.left_negative', 'D;JLT',
+        '@R13', 'D=M', f'@{name}.right_negative', 'D;JLT', f'@{name}.same_sign', '0;JMP',
+        f'({name}.left_negative)', '@R13', 'D=M', f'@{name}.same_sign', 'D;JLT',
+        f'D={left_negative}', '@R14', 'A=M', '0;JMP',
+        f'({name}.right_negative)', f'D={right_negative}', '@R14', 'A=M', '0;JMP',
+        f'({name}.same_sign)', '@R15', 'D=M', '@R13', 'D=D-M', f'@{name}.true', f'D;{holds}',
+        'D=0', '@R14', 'A=M', '0;JMP',
+        f'({name}.true)', 'D=-1', '@R14', 'A=M', '0;JMP',
+    ]
+
+
+class HackWriter:
+    """
+    Lower VM code straight to Hack assembly, for a whole program in a single .asm file. The top of the stack is kept
+    in D between commands whenever possible, so most commands never touch the stack in memory, and comparisons that
+    are followed by a jump become a single conditional jump. Calls, returns and signed comparisons go through shared
+    routines to keep the program small.
+    """
+
+    def __init__(self, sink: typing.TextIO):
+        """
+        Create a new Hack writer.
+        :param sink: a text stream that the assembly is written to.
+        """
+        self.__sink = sink
+        self.__lines = []
+        self.__instructions = 0
+        self.__routine_instructions = 0
+        self.__class_name = ''
+        self.__function_name = ''
+        self.__label_count = 0
+        self.__routines = set()
+        # Whether D holds the top of the stack, which is then not in memory.
+        self.__top_in_d = False
+
+    def get_instruction_count(self) -> int:
+        """
+        :return: the number of instructions written so far, not counting labels.
+        """
+        return self.__instructions
+
+    def get_routine_instructions(self) -> int:
+        """
+        :return: the number of instructions that the shared routines run for the jumps to them written so far.
+        """
+        return self.__routine_instructions
+
+    def __emit(self, *lines: str):
+        self.__lines.extend(lines)
+
+    def __new_label(self) -> str:
+        self.__label_count += 1
+        return f'{self.__function_name}$${self.__label_count}'
+
+    def __flush(self):
+        """
+        Push D onto the stack in memory if it holds the top of the stack.
+        """
+        if self.__top_in_d:
+            self.__emit('@SP', 'AM=M+1', 'A=A-1', 'M=D')
+            self.__top_in_d = False
+
+    def __load_top(self):
+        """
+        Make D hold the top of the stack, popping it from memory if needed.
+        """
+        if not self.__top_in_d:
+            self.__emit('@SP', 'AM=M-1', 'D=M')
+            self.__top_in_d = True
+
+    def __address(self, segment: int, index: int) -> typing.List[str]:
+        """
+        :return: instructions that point A at an entry of a segment, without changing D. Entries of the segments
+        that are reached through a base pointer must be close to it.
+        """
+        if segment == STATIC:
+            return [f'@{self.__class_name}.{index}']
+        if segment == TEMP:
+            return [f'@R{TEMP_START + index}']
+        if segment == POINTER:
+            return [f'@{POINTERS[index]}']
+        if index == 0:
+            return [f'@{BASE_POINTERS[segment]}', 'A=M']
+        return [f'@{BASE_POINTERS[segment]}', 'A=M+1'] + ['A=A+1'] * (index - 1)
+
+    def __write_push(self, segment: int, index: int):
+        self.__flush()
+        if segment == CONSTANT:
+            self.__emit(f'@{index}', 'D=A')
+        elif segment in BASE_POINTERS and index > MAX_STEPS:
+            self.__emit(f'@{index}', 'D=A', f'@{BASE_POINTERS[segment]}', 'A=D+M', 'D=M')
+        else:
+            self.__emit(*self.__address(segment, index), 'D=M')
+        self.__top_in_d = True
+
+    def __write_pop(self, segment: int, index: int):
+        if segment in BASE_POINTERS and index > MAX_STEPS:
+            self.__flush()
+            self.__emit(f'@{index}', 'D=A', f'@{BASE_POINTERS[segment]}', 'D=D+M', f'@{R13}', 'M=D',
+                        '@SP', 'AM=M-1', 'D=M', f'@{R13}', 'A=M', 'M=D')
+        else:
+            self.__load_top()
+            self.__emit(*self.__address(segment, index), 'M=D')
+        self.__top_in_d = False
+
+    def __write_jump_if(self, opcode: int, constant: typing.Optional[int], label: str, holds: bool):
+        """
+        Jump to a label if a comparison holds, or if it does not. The left operand is on the stack, and so is the
+        right one unless it is a constant.
+        :param opcode: the comparison.
+        :param constant: the right operand if it is a non-negative constant, else None.
+        :param label: the label to jump to.
+        :param holds: whether to jump when the comparison holds, else when it does not.
+        """
+        jump = COMPARISON_JUMPS[opcode][0 if holds else 1]
+        if opcode == EQ or constant == 0:
+            # Subtracting to compare for equality cannot give a wrong answer, and neither can comparing with 0.
+            if constant is None:
+                self.__load_top()
+                self.__emit('@SP', 'AM=M-1', 'D=M-D')
+            else:
+                self.__load_top()
+                if constant != 0:
+                    self.__emit(f'@{constant}', 'D=D-A')
+            self.__emit(f'@{label}', f'D;{jump}')
+        elif constant is not None:
+            # A non-negative left operand minus a non-negative constant cannot overflow, and a negative left
+            # operand is less than the constant.
+            self.__load_top()
+            if (opcode == LT) == holds:
+                self.__emit(f'@{label}', 'D;JLT', f'@{constant}', 'D=D-A', f'@{label}', f'D;{jump}')
+            else:
+                skip = self.__new_label()
+                self.__emit(f'@{skip}', 'D;JLT', f'@{constant}', 'D=D-A', f'@{label}', f'D;{jump}', f'({skip})')
+        else:
+            self.__write_compare_call(opcode)
+            self.__emit(f'@{label}', 'D;JNE' if holds else 'D;JEQ')
+        self.__top_in_d = False
+
+    def __write_compare_call(self, opcode: int):
+        """
+        Compare the two values on top of the stack with a shared routine, leaving the result in D.
+        """
+        self.__load_top()
+        return_label = self.__new_label()
+        self.__routines.add(opcode)
+        self.__routine_instructions += COMPARE_ROUTINE_INSTRUCTIONS
+        self.__emit(f'@{R13}', 'M=D', f'@{return_label}', 'D=A', f'@{R14}', 'M=D', '@SP', 'AM=M-1', 'D=M',
+                    f'@{COMPARE_ROUTINES[opcode]}', '0;JMP', f'({return_label})')
+        self.__top_in_d = True
+
+    def __write_comparison(self, opcode: int, constant: typing.Optional[int]):
+        """
+        Compute a comparison into D, as true or false.
+        """
+        if opcode != EQ and constant is None:
+            self.__write_compare_call(opcode)
+            return
+        true_label = self.__new_label()
+        end_label = self.__new_label()
+        self.__write_jump_if(opcode, constant, true_label, True)
+        self.__emit('D=0', f'@{end_label}', '0;JMP', f'({true_label})', 'D=-1', f'({end_label})')
+        self.__top_in_d = True
+
+    def __write_call(self, function_name: str, arg_count: int):
+        self.__flush()
+        return_label = self.__new_label()
+        self.__routine_instructions += CALL_ROUTINE_INSTRUCTIONS
+        self.__emit(f'@{arg_count}', 'D=A', f'@{R13}', 'M=D', f'@{function_name}', 'D=A', f'@{R14}', 'M=D',
+                    f'@{return_label}', 'D=A', f'@{CALL_ROUTINE}', '0;JMP', f'({return_label})')
+
+    def write_bootstrap(self, entry_point: str):
+        """
+        Write the code that sets up the stack and calls the entry point of the program, then halts.
+        :param entry_point: the function the program starts from, such as Sys.init.
+        """
+        self.__function_name = HALT_LABEL
+        self.__emit(f'@{STACK_START}', 'D=A', '@SP', 'M=D')
+        self.__write_call(entry_point, 0)
+        self.__emit(f'({HALT_LABEL})', f'@{HALT_LABEL}', '0;JMP')
+        self.__write()
+
+    def write_class(self, class_name: str, code: typing.Sequence[int]):
+        """
+        Lower the VM code of a class.
+        :param class_name: name of the class, which names its static variables.
+        :param code: the VM commands of the class.
+        """
+        self.__class_name = class_name
+        index = 0
+        while index < len(code):
+            line = code[index]
+            opcode = line & OPCODE_MASK
+            following = code[index + 1] if index + 1 < len(code) else None
+            if opcode == PUSH:
+                constant = constant_of(line)
+                if following in COMPARISON_JUMPS and constant is not None:
+                    # Compare with the constant directly, without pushing it.
+                    index = self.__write_fused_comparison(code, index + 1, constant)
+                    continue
+                self.__write_push(argument_of(line), operand_of(line))
+            elif opcode == POP:
+                self.__write_pop(argument_of(line), operand_of(line))
+            elif line in BINARY_COMPUTATIONS:
+                self.__load_top()
+                self.__emit('@SP', 'AM=M-1', BINARY_COMPUTATIONS[line])
+            elif line in UNARY_COMPUTATIONS:
+                self.__load_top()
+                self.__emit(UNARY_COMPUTATIONS[line])
+            elif line in COMPARISON_JUMPS:
+                index = self.__write_fused_comparison(code, index, None)
+                continue
+            elif opcode == LABEL:
+                self.__flush()
+                self.__emit(f'({self.__function_name}${name_of(line)})')
+            elif opcode == GOTO:
+                self.__flush()
+                self.__emit(f'@{self.__function_name}${name_of(line)}', '0;JMP')
+            elif opcode == IF_GOTO:
+                self.__load_top()
+                self.__emit(f'@{self.__function_name}${name_of(line)}', 'D;JNE')
+                self.__top_in_d = False
+            elif opcode == FUNCTION:
+                self.__write_function(name_of(line), argument_of(line))
+            elif opcode == CALL:
+                self.__write_call(name_of(line), argument_of(line))
+            elif line == RETURN:
+                self.__load_top()
+                self.__routine_instructions += RETURN_ROUTINE_INSTRUCTIONS
+                self.__emit(f'@{RETURN_ROUTINE}', '0;JMP')
+                self.__top_in_d = False
+            index += 1
+        self.__write()
+
+    def __write_fused_comparison(self, code: typing.Sequence[int], index: int, constant: typing.Optional[int]) -> int:
+        """
+        Write a comparison, jumping on it directly if it is followed by an if-goto, possibly after a 'not'.
+        :param code: the VM commands of the class.
+        :param index: the index of the comparison.
+        :param constant: the right operand if it was a constant that was not pushed, else None.
+        :return: the index of the next command to lower.
+        """
+        opcode = code[index]
+        holds = True
+        following = index + 1
+        if following < len(code) and code[following] == NOT:
+            holds = False
+            following += 1
+        if following < len(code) and code[following] & OPCODE_MASK == IF_GOTO:
+            self.__write_jump_if(opcode, constant, f'{self.__function_name}${name_of(code[following])}', holds)
+            return following + 1
+        self.__write_comparison(opcode, constant)
+        return index + 1
+
+    def __write_function(self, function_name: str, local_count: int):
+        self.__flush()
+        self.__function_name = function_name
+        self.__label_count = 0
+        self.__emit(f'({function_name})')
+        if local_count > 0:
+            self.__emit('@SP', 'A=M')
+            for _ in range(local_count):
+                self.__emit('M=0', 'A=A+1')
+            self.__emit('D=A', '@SP', 'M=D')
+        self.__top_in_d = False
+
+    def close(self):
+        """
+        Write the shared routines that the program uses.
+        """
+        self.__emit(*CALL_ROUTINE_CODE, *RETURN_ROUTINE_CODE)
+        for opcode in sorted(self.__routines):
+            self.__emit(*compare_routine_code(opcode))
+        self.__write()
+
+    def __write(self):
+        if not self.__lines:
+            return
+        self.__instructions += sum(1 for line in self.__lines if not line.startswith('('))
+        self.__sink.write('\n'.join(self.__lines) + '\n')
+        self.__lines = []
@@ -0,0 +1,171 @@
+import typing
+
+from VMCode import PUSH, POP, LABEL, GOTO, IF_GOTO, FUNCTION, CALL, RETURN, ARGUMENT, LOCAL, STATIC, \
+    THIS, THAT, POINTER, TEMP, OPCODE_MASK, push, pop, push_constant, argument_of, operand_of, name_of
+
+# The largest number of commands in the body of an inlined subroutine, unless given.
+DEFAULT_MAX_SIZE = 8
+# A method's first two commands, which point 'this' at the object.
+SET_THIS = [push(ARGUMENT, 0), pop(POINTER, 0)]
+# The commands that point 'that' at the object instead, once a method is inlined.
+SET_THAT = [push(ARGUMENT, 0), pop(POINTER, 1)]
+# Arguments and locals of an inlined body live in these temp registers. The compiler only ever uses temp 0 and 1,
+# and never keeps a temp across a call, so they are free at every call site.
+FIRST_TEMP = 2
+LAST_TEMP = 7
+# Commands that end straight-line code.
+BRANCHES = {LABEL, GOTO, IF_GOTO, FUNCTION, CALL, RETURN}
+
+
+class Callee:
+    """
+    A small leaf subroutine that can be inlined: straight-line code that calls nothing and returns at its end.
+    """
+
+    def __init__(self, name: str, local_count: int, body: typing.List[int], is_method: bool, uses_static: bool):
+        """
+        Create a new inlinable subroutine.
+        :param name: name of the subroutine.
+        :param local_count: number of local variables of the subroutine.
+        :param body: the commands of the subroutine, without its function command, its final return, and for a
+            method, the commands that set 'this'.
+        :param is_method: whether the subroutine sets 'this' to its first argument.
+        :param uses_static: whether the subroutine uses the static segment of its class.
+        """
+        self.name = name
+        self.local_count = local_count
+        self.body = body
+        self.is_method = is_method
+        self.uses_static = uses_static
+
+
+def parse_callee(lines: typing.List[int], max_size: int) -> typing.Optional[Callee]:
+    """
+    Check whether a subroutine can be inlined.
+    :param lines: the VM commands of the subroutine.
+    :param max_size: the largest number of commands in the body of an inlined subroutine.
+    :return: the subroutine, or None if it cannot be inlined.
+    """
+    body = lines[1:-1]
+    if lines[-1] != RETURN or len(body) > max_size:
+        return None
+    is_method = body[:2] == SET_THIS
+    if is_method:
+        body = body[2:]
+    uses_static = False
+    for line in body:
+        opcode = line & OPCODE_MASK
+        if opcode in BRANCHES:
+            return None
+        if opcode != PUSH and opcode != POP:
+            continue
+        segment = argument_of(line)
+        if segment == POINTER or (segment == TEMP and operand_of(line) >= FIRST_TEMP) \
+                or (segment == THIS and not is_method) or (segment == THAT and is_method):
+            # 'this' is reached through 'that' once inlined, so a method cannot use 'that' for anything else.
+            return None
+        uses_static = uses_static or segment == STATIC
+    return Callee(name_of(lines[0]), argument_of(lines[0]), body, is_method, uses_static)
+
+
+class Inliner:
+    """
+    Replace calls to small leaf subroutines with their code. The arguments and locals of an inlined subroutine are
+    kept in temp registers, and a method reaches its object through 'that' so the caller's 'this' is untouched.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        Create a new inliner.
+        :param max_size: the largest number of commands in the body of an inlined subroutine.
+        """
+        self.__max_size = max_size
+        self.__inlined_sites = 0
+        self.__inlined_functions = set()
+
+    def get_inlined_sites(self) -> int:
+        """
+        :return: the number of calls that were replaced by the code of the subroutine they call.
+        """
+        return self.__inlined_sites
+
+    def get_inlined_functions(self) -> typing.Set[str]:
+        """
+        :return: names of the subroutines that were inlined at least once.
+        """
+        return self.__inlined_functions
+
+    @staticmethod
+    def __inline_call(callee: Callee, arg_count: int) -> typing.Optional[typing.List[int]]:
+        """
+        :param callee: the subroutine to inline.
+        :param arg_count: the number of arguments the call passes.
+        :return: the commands that replace the call, or None if the arguments and locals do not fit in the temps.
+        """
+        if FIRST_TEMP + arg_count + callee.local_count - 1 > LAST_TEMP:
+            return None
+        body = SET_THAT + callee.body if callee.is_method else list(callee.body)
+        argument_uses = [0] * arg_count
+        for line in body:
+            opcode = line & OPCODE_MASK
+            if (opcode == PUSH or opcode == POP) and argument_of(line) == ARGUMENT:
+                index = operand_of(line)
+                if index >= arg_count:
+                    return None
+                argument_uses[index] += 1
+        # The first argument is left on the stack if the body starts by pushing it and never uses it again.
+        keep_first = arg_count > 0 and len(body) > 0 and body[0] == SET_THAT[0] and argument_uses[0] == 1
+        code = [pop(TEMP, FIRST_TEMP + index) for index in range(arg_count - 1, 0 if keep_first else -1, -1)]
+        for index in range(callee.local_count):
+            code += [push_constant(0), pop(TEMP, FIRST_TEMP + arg_count + index)]
+        for line in body[1:] if keep_first else body:
+            opcode = line & OPCODE_MASK
+            if opcode == PUSH or opcode == POP:
+                segment = argument_of(line)
+                index = operand_of(line)
+                move = push if opcode == PUSH else pop
+                if segment == ARGUMENT:
+                    line = move(TEMP, FIRST_TEMP + index)
+                elif segment == LOCAL:
+                    line = move(TEMP, FIRST_TEMP + arg_count + index)
+                elif segment == THIS:
+                    line = move(THAT, index)
+            code.append(line)
+        return code
+
+    def inline(self, functions: typing.Dict[str, typing.List[int]]) -> typing.Set[str]:
+        """
+        Inline calls to small leaf subroutines, until no more calls can be inlined. A subroutine that becomes a
+        small leaf by having its own calls inlined is inlined in turn.
+        :param functions: the VM commands of every subroutine of the program, by name. They are changed in place.
+        :return: names of the subroutines whose code changed.
+        """
+        changed = set()
+        while True:
+            callees = {}
+            for name, lines in functions.items():
+                callee = parse_callee(lines, self.__max_size)
+                if callee is not None:
+                    callees[name] = callee
+            changed_this_round = False
+            for name, lines in functions.items():
+                class_name = name.split('.')[0]
+                output = []
+                for line in lines:
+                    if line & OPCODE_MASK == CALL:
+                        callee_name = name_of(line)
+                        callee = callees.get(callee_name)
+                        if callee is not None and callee_name != name and \
+                                (not callee.uses_static or callee_name.split('.')[0] == class_name):
+                            code = self.__inline_call(callee, argument_of(line))
+                            if code is not None:
+                                output += code
+                                self.__inlined_sites += 1
+                                self.__inlined_functions.add(callee_name)
+                                changed_this_round = True
+                                changed.add(name)
+                                continue
+                    output.append(line)
+                lines[:] = output
+            if not changed_this_round:
+                return changed
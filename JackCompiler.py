@@ -1,22 +1,510 @@
 """
 A program that compiles jack files.
 """
+import argparse
+import concurrent.futures
+import contextlib
+import io
+import json
 import os
 import sys
-from FileHandler import FileHandler
+import typing
+
+from BatchCompiler import BatchCompiler
+from BuildCache import BuildCache, sources_hash
+from CompileOptions import CompileOptions
+from CompileStats import FileStats
+from CostReport import CostReport
+from FileHandler import FileHandler, replace_file
+from HackWriter import HackWriter
+from Inliner import Inliner, DEFAULT_MAX_SIZE
+from Linker import Linker, ENTRY_POINT, split_functions
+from PeepholeOptimizer import PeepholeOptimizer
+from VMCode import PUSH, POP, STATIC, OPCODE_MASK, argument_of, operand_of, reset_names
+from VMWriter import STATIC_BUDGET
+from Watcher import Watcher, DEFAULT_INTERVAL
+
+# The result of compiling a file: what the compiler printed, the error if it failed, the number of VM commands
+# removed by the optimizers, the statistics of the compilation if they were collected, the VM code if it was
+# kept in memory for linking, and the costs of its subroutines if they were collected.
+Result = typing.Tuple[str, typing.Optional[str], int, typing.Optional[FileStats], typing.Optional[str],
+                      typing.Optional[CostReport]]
+# A function that is called with the statistics of every compiled file.
+StatsHook = typing.Callable[[FileStats], typing.Any]
+# A function that is called with the costs of the subroutines of every compiled file.
+CostHook = typing.Callable[[CostReport], typing.Any]
+# The function a program compiled to Hack assembly starts from, if it has one. Otherwise it starts from Main.main.
+SYS_INIT = 'Sys.init'
+
+
+def compile_file(source_file: str, source_dir: str, options: CompileOptions, to_stdout: bool = False,
+                 collect_stats: bool = False, collect_costs: bool = False, keep_code: bool = False) -> Result:
+    """
+    Compile a single .jack file, capturing anything the compiler prints so it can be reported in order.
+    :param source_file: name of the .jack file.
+    :param source_dir: directory of the .jack file.
+    :param options: options to compile with.
+    :param to_stdout: print the VM code instead of writing it to the .vm file.
+    :param collect_stats: whether to collect the statistics of the compilation.
+    :param collect_costs: whether to collect the costs of the subroutines of the file.
+    :param keep_code: keep the VM code in memory and return it instead of writing it to the .vm file, as is always
+        done in whole program mode.
+    :return: the result of the compilation.
+    """
+    # Only the text of the code is returned, so the names of the previous file, possibly compiled by the same
+    # worker process, are not needed anymore.
+    reset_names()
+    output = io.StringIO()
+    error = None
+    removed = 0
+    stats = FileStats(source_file) if collect_stats else None
+    costs = CostReport() if collect_costs else None
+    code = None
+    with contextlib.redirect_stdout(output):
+        try:
+            handler = FileHandler(source_file, source_dir, options=options, stats=stats, cost_report=costs)
+            if options.whole_program or keep_code:
+                sink = io.StringIO()
+                handler.compile_to(sink)
+                code = sink.getvalue()
+            elif to_stdout:
+                handler.compile_to(sys.stdout)
+                print()
+            else:
+                handler.compile()
+            removed = handler.get_removed()
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+    return output.getvalue(), error, removed, stats, code, costs
+
+
+def compile_files(file_list: typing.List[str], source_dir: str, options: CompileOptions, jobs: int = 1,
+                  cache: typing.Optional[BuildCache] = None, to_stdout: bool = False,
+                  stats_hook: typing.Optional[StatsHook] = None, asm_file: typing.Optional[str] = None,
+                  cost_hook: typing.Optional[CostHook] = None) -> bool:
+    """
+    Compile .jack files, possibly in parallel, and report the result of each file in the order of the list.
+    :param file_list: names of the .jack files.
+    :param source_dir: directory of the .jack files.
+    :param options: options to compile with.
+    :param jobs: number of processes to compile with.
+    :param cache: build cache of the directory, files whose output is up to date are skipped.
+    :param to_stdout: print the VM code instead of writing it to .vm files.
+    :param stats_hook: a function to call with the statistics of each compiled file, in the order of the list.
+        Statistics are only collected when it is given.
+    :param asm_file: in whole program mode, write the program to this Hack assembly file instead of .vm files.
+    :param cost_hook: a function to call with the costs of the subroutines of each compiled file, in the order of
+        the list, or in whole program mode once with those of the linked program. Costs are only collected when it is
+        given.
+    :return: whether all the files compiled successfully.
+    """
+    collect_stats = stats_hook is not None
+    collect_costs = cost_hook is not None
+    if options.whole_program:
+        # The output of every file depends on all the others, so they are compiled together or not at all.
+        if cache is not None and all(cache.is_up_to_date(file) for file in file_list):
+            return True
+        return link_program(file_list, source_dir, options, jobs, cache, to_stdout, stats_hook, asm_file, cost_hook)
+    if cache is not None:
+        file_list = [file for file in file_list if not cache.is_up_to_date(file)]
+    # Pooled strings take statics, so the classes may not fit together even though each of them does. The code is
+    # then kept in memory and only written once the statics of the whole program are known to fit.
+    keep_code = options.string_pool and not to_stdout
+    results = []
+    if jobs > 1 and len(file_list) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            count = len(file_list)
+            compiled = executor.map(compile_file, file_list, [source_dir] * count, [options] * count,
+                                    [to_stdout] * count, [collect_stats] * count, [collect_costs] * count,
+                                    [keep_code] * count)
+            success = report(file_list, keep_results(compiled, results), options, None if keep_code else cache,
+                             stats_hook, cost_hook)
+    else:
+        compiled = (compile_file(file, source_dir, options, to_stdout, collect_stats, collect_costs, keep_code)
+                    for file in file_list)
+        success = report(file_list, keep_results(compiled, results), options, None if keep_code else cache,
+                         stats_hook, cost_hook)
+    if keep_code:
+        return write_checked(file_list, results, source_dir, cache) and success
+    if to_stdout and options.string_pool:
+        classes = [result[0] for result in results] + [read_code(source_dir, file)
+                                                      for file in library_files(source_dir)]
+        return check_statics(classes) and success
+    return success
+
+
+def keep_results(results: typing.Iterable[Result], kept: typing.List[Result]) -> typing.Iterator[Result]:
+    """
+    Pass results through, keeping each of them.
+    """
+    for result in results:
+        kept.append(result)
+        yield result
+
+
+def write_checked(file_list: typing.List[str], results: typing.List[Result], source_dir: str,
+                  cache: typing.Optional[BuildCache] = None) -> bool:
+    """
+    Write the VM code that was kept in memory for .jack files, and record it in the build cache, but only if the
+    statics of the whole program fit together with the .vm files that are already in the directory.
+    :return: whether the statics fit. If they do not, nothing is written.
+    """
+    targets = {file[:-5] + '.vm': result[4] for file, result in zip(file_list, results)}
+    classes = [code for code in targets.values() if code is not None]
+    classes += [read_code(source_dir, file) for file in os.listdir(source_dir or '.')
+                if file[-3:] == '.vm' and targets.get(file) is None]
+    if not check_statics(classes):
+        if cache is not None:
+            for file in file_list:
+                cache.invalidate(file)
+            cache.save()
+        return False
+    for file, (output, error, _, _, code, _) in zip(file_list, results):
+        if code is not None:
+            replace_file(os.path.join(source_dir, file[:-5] + '.vm'), code)
+        if cache is not None:
+            if error is None and not output:
+                cache.update(file)
+            else:
+                cache.invalidate(file)
+    if cache is not None:
+        cache.save()
+    return True
+
+
+def read_code(source_dir: str, file: str) -> str:
+    """
+    :return: the text of a file of a directory.
+    """
+    with open(os.path.join(source_dir, file)) as source:
+        return source.read()
+
+
+def count_statics(code: typing.Iterable[int]) -> int:
+    """
+    :param code: the VM commands of a class.
+    :return: the number of statics of the class that the commands use, each of which takes a word of RAM.
+    """
+    return len({operand_of(line) for line in code
+                if line & OPCODE_MASK in (PUSH, POP) and argument_of(line) == STATIC})
+
+
+def check_statics(classes: typing.Iterable[typing.Union[str, typing.List[int]]]) -> bool:
+    """
+    Check that the statics of all the classes of a program fit in the RAM that holds them.
+    :param classes: the VM code of every class, either as text or as commands.
+    :return: whether the statics fit. If they do not, an error is printed.
+    """
+    total = 0
+    for code in classes:
+        if isinstance(code, str):
+            code = [line for _, lines in split_functions(code) for line in lines]
+        total += count_statics(code)
+    if total > STATIC_BUDGET:
+        print(f'The program uses {total} statics, but only {STATIC_BUDGET} fit in RAM. Compile it without '
+              f'--string-pool.', file=sys.stderr)
+        return False
+    return True
+
+
+def link_program(file_list: typing.List[str], source_dir: str, options: CompileOptions, jobs: int = 1,
+                 cache: typing.Optional[BuildCache] = None, to_stdout: bool = False,
+                 stats_hook: typing.Optional[StatsHook] = None, asm_file: typing.Optional[str] = None,
+                 cost_hook: typing.Optional[CostHook] = None) -> bool:
+    """
+    Compile all the .jack files of a program, then link them, dropping the subroutines that Main.main never calls.
+    Unless the program is written to Hack assembly, which starts from Sys.init alone, Sys.init and the .vm files that
+    have no .jack file are kept with the subroutines they call, since the VM bootstrap calls Sys.init. Small leaf
+    subroutines are inlined first if the options ask for it, so the ones that are no longer called are
+    dropped as well. Nothing is written unless every file compiles successfully.
+    :param asm_file: write the program to this Hack assembly file instead of .vm files, together with the .vm files
+        of the directory that have no .jack file, such as the OS.
+    :param cost_hook: a function to call once with the costs of the subroutines of the linked program, without those
+        of the .vm files that have no .jack file.
+    :return: whether all the files compiled successfully and the program was written.
+    """
+    collect_stats = stats_hook is not None
+    count = len(file_list)
+    # Costs are collected from the linked program instead of the compiled files, so they leave out the subroutines
+    # that are dropped and account for the calls that are inlined.
+    if jobs > 1 and count > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(compile_file, file_list, [source_dir] * count, [options] * count,
+                                        [to_stdout] * count, [collect_stats] * count))
+    else:
+        results = [compile_file(file, source_dir, options, to_stdout, collect_stats) for file in file_list]
+    if not report(file_list, results, options, None, stats_hook) or any(result[0] for result in results):
+        if cache is not None:
+            for file in file_list:
+                cache.invalidate(file)
+            cache.save()
+        return False
+
+    linker = Linker()
+    for file, result in zip(file_list, results):
+        linker.add(file, result[4])
+    if asm_file is not None:
+        for file in library_files(source_dir):
+            linker.add(file, read_code(source_dir, file))
+        if SYS_INIT in linker.get_functions():
+            linker.set_entry_point(SYS_INIT)
+    if options.inline_size > 0:
+        inline(linker, options)
+    if asm_file is None:
+        # The VM bootstrap calls Sys.init, and the .vm files that have no .jack file are used as they are, so they are
+        # kept together with everything they call. They are added after inlining, which must not change them.
+        for file in library_files(source_dir):
+            linker.add(file, read_code(source_dir, file), keep=True)
+        if SYS_INIT in linker.get_functions():
+            linker.add_root(SYS_INIT)
+    linked_code = linker.link_code()
+    if cost_hook is not None:
+        costs = CostReport()
+        for file in file_list:
+            costs.add(linked_code[file])
+        cost_hook(costs)
+    if options.string_pool and not check_statics(linked_code.values()):
+        return False
+    if asm_file is not None:
+        return write_program(linker, asm_file, to_stdout)
+    linked = linker.link()
+    for file in file_list:
+        if to_stdout:
+            print(linked[file])
+        else:
+            replace_file(os.path.join(source_dir, file[:-5] + '.vm'), linked[file])
+            if cache is not None:
+                cache.update(file)
+    if cache is not None:
+        cache.save()
+    if not linker.has_entry_point():
+        print('There is no Main.main, so no subroutine was removed.', file=sys.stderr)
+    else:
+        roots = f'{ENTRY_POINT} and {SYS_INIT} never call' if SYS_INIT in linker.get_functions() \
+            else f'{ENTRY_POINT} never calls'
+        print(f'Removed {len(linker.get_removed_functions())} of {linker.get_function_count()} subroutines '
+              f'({linker.get_removed_commands()} VM commands) that {roots}.', file=sys.stderr)
+    return True
+
+
+def library_files(source_dir: str) -> typing.List[str]:
+    """
+    :return: names of the .vm files of a directory that were not compiled from a .jack file in it, such as the OS.
+    """
+    files = os.listdir(source_dir or '.')
+    return sorted(file for file in files if file[-3:] == '.vm' and file[:-3] + '.jack' not in files)
+
+
+def write_program(linker: Linker, asm_file: str, to_stdout: bool = False) -> bool:
+    """
+    Lower a linked program to Hack assembly, starting with the bootstrap code that calls its entry point.
+    :param linker: the linker that holds the program.
+    :param asm_file: the Hack assembly file to write.
+    :param to_stdout: print the assembly instead of writing it to the file.
+    :return: whether the program was written, which fails if it has no entry point or calls undefined subroutines.
+    """
+    if not linker.has_entry_point():
+        print(f'There is no {SYS_INIT} or {ENTRY_POINT} to start the program from.', file=sys.stderr)
+        return False
+    undefined = linker.get_undefined_calls()
+    if undefined:
+        print(f'Subroutines are called but not defined: {", ".join(undefined)}.', file=sys.stderr)
+        return False
+    sink = sys.stdout if to_stdout else io.StringIO()
+    writer = HackWriter(sink)
+    writer.write_bootstrap(linker.get_entry_point())
+    for name, code in linker.link_code().items():
+        writer.write_class(os.path.splitext(name)[0], code)
+    writer.close()
+    if not to_stdout:
+        replace_file(asm_file, sink.getvalue())
+    print(f'Wrote {writer.get_instruction_count()} Hack instructions, without the '
+          f'{len(linker.get_removed_functions())} of {linker.get_function_count()} subroutines that '
+          f'{linker.get_entry_point()} never calls.', file=sys.stderr)
+    return True
+
+
+def inline(linker: Linker, options: CompileOptions):
+    """
+    Inline the calls to small leaf subroutines in a program, and report what was inlined.
+    :param linker: the linker that holds the program.
+    :param options: options the program was compiled with.
+    """
+    inliner = Inliner(options.inline_size)
+    functions = linker.get_functions()
+    changed = inliner.inline(functions)
+    if options.peephole:
+        optimizer = PeepholeOptimizer()
+        for name in changed:
+            functions[name][:] = optimizer.optimize(functions[name])
+    inlined = sorted(inliner.get_inlined_functions())
+    print(f'Inlined {inliner.get_inlined_sites()} calls to {len(inlined)} subroutines'
+          + (f': {", ".join(inlined)}.' if inlined else '.'), file=sys.stderr)
+
+
+def report(file_list: typing.List[str], results: typing.Iterable[Result], options: CompileOptions,
+           cache: typing.Optional[BuildCache] = None, stats_hook: typing.Optional[StatsHook] = None,
+           cost_hook: typing.Optional[CostHook] = None) -> bool:
+    """
+    Print the output and errors of compiled files, and record them in the build cache.
+    :return: whether all the files compiled successfully.
+    """
+    success = True
+    total_removed = 0
+    for file, (output, error, removed, stats, _, costs) in zip(file_list, results):
+        print(output, end='')
+        if stats_hook is not None and stats is not None:
+            stats_hook(stats)
+        if cost_hook is not None and costs is not None:
+            cost_hook(costs)
+        if error is not None:
+            print(f'{file}: {error}', file=sys.stderr)
+            success = False
+        total_removed += removed
+        if cache is not None:
+            if error is None and not output:
+                cache.update(file)
+            else:
+                cache.invalidate(file)
+    if cache is not None:
+        cache.save()
+    if options.peephole or options.optimize_control_flow:
+        print(f'Optimizers removed {total_removed} VM commands.', file=sys.stderr)
+    return success
+
 
 if __name__ == '__main__':
-    if len(sys.argv) is not 2:
-        print("Bad Parameters!")
-        exit(1)
-    input_path = sys.argv[1]
+    arg_parser = argparse.ArgumentParser(description='Compile .jack files into .vm files.')
+    arg_parser.add_argument('input_path', help="a .jack file or a directory of .jack files, or with --batch an "
+                                               "archive of .jack files or '-' for a tar archive on stdin")
+    arg_parser.add_argument('-j', '--jobs', type=int, default=1,
+                            help='number of files to compile in parallel, 0 for one per CPU')
+    arg_parser.add_argument('-f', '--force', action='store_true',
+                            help='recompile every file, even if its .vm output is up to date')
+    arg_parser.add_argument('--stdout', action='store_true',
+                            help='print the VM code instead of writing .vm files')
+    arg_parser.add_argument('--peephole', action='store_true',
+                            help='rewrite redundant sequences of VM commands into shorter ones')
+    arg_parser.add_argument('--fold-constants', action='store_true',
+                            help='evaluate constant expressions at compile time and replace multiplications by '
+                                 'constants with additions')
+    arg_parser.add_argument('--string-pool', action='store_true',
+                            help='build each distinct string literal of a class once and reuse it afterwards')
+    arg_parser.add_argument('--optimize-control-flow', action='store_true',
+                            help='avoid negated conditions, drop branches that cannot run and simplify jumps')
+    arg_parser.add_argument('--optimize-arrays', action='store_true',
+                            help='address constant array indices directly and skip temp 0 in array assignments '
+                                 'when possible')
+    arg_parser.add_argument('--xml', action='store_true',
+                            help='also write the parse tree of each file to an .xml file, streamed as it is parsed')
+    arg_parser.add_argument('--stats', action='store_true',
+                            help='print the time of each phase and counts of tokens, tokenizer calls and VM commands '
+                                 'of each file')
+    arg_parser.add_argument('--cost-report', metavar='FILE',
+                            help='print the commands, OS calls and estimated Hack cycles of each subroutine, the most '
+                                 'expensive first, and write them to FILE as JSON')
+    arg_parser.add_argument('--profile', metavar='FILE',
+                            help='compile in a single process under cProfile and dump the pstats to FILE')
+    arg_parser.add_argument('--watch', action='store_true',
+                            help='keep running, and compile the changed subroutines of .jack files as they change')
+    arg_parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL,
+                            help='seconds between checks for changed files in watch mode')
+    arg_parser.add_argument('--whole-program', action='store_true',
+                            help='compile the directory as one program, dropping subroutines that Main.main and '
+                                 'Sys.init never call')
+    arg_parser.add_argument('--asm', action='store_true',
+                            help='compile the directory as one program straight to a single Hack assembly file, '
+                                 'with the .vm files that have no .jack file, such as the OS')
+    arg_parser.add_argument('--inline', action='store_true',
+                            help='with --whole-program or --asm, replace calls to small leaf subroutines, such as '
+                                 'getters and setters, with their code')
+    arg_parser.add_argument('--inline-size', type=int, default=DEFAULT_MAX_SIZE,
+                            help='the largest number of VM commands in the body of an inlined subroutine')
+    arg_parser.add_argument('--batch', action='store_true',
+                            help='compile the .jack files of a tar or zip archive in memory, and stream their .vm '
+                                 'files to stdout as a tar archive')
+    args = arg_parser.parse_args()
+    if args.watch and args.whole_program:
+        arg_parser.error('--watch cannot be combined with --whole-program')
+    if args.watch and args.asm:
+        arg_parser.error('--watch cannot be combined with --asm')
+    if args.inline and not (args.whole_program or args.asm):
+        arg_parser.error('--inline requires --whole-program or --asm')
+    if args.cost_report and (args.watch or args.batch):
+        arg_parser.error('--cost-report cannot be combined with --watch or --batch')
+    if args.batch and (args.watch or args.whole_program or args.asm or args.stdout or args.xml):
+        arg_parser.error('--batch cannot be combined with --watch, --whole-program, --asm, --stdout or --xml')
+    input_path = args.input_path
+    if args.batch:
+        batch_compiler = BatchCompiler(CompileOptions(peephole=args.peephole, fold_constants=args.fold_constants,
+                                                      string_pool=args.string_pool,
+                                                      optimize_control_flow=args.optimize_control_flow,
+                                                      optimize_arrays=args.optimize_arrays))
+        success = batch_compiler.run(input_path, sys.stdout.buffer)
+        print(f'Compiled {batch_compiler.get_compiled()} files, {batch_compiler.get_failed()} failed.',
+              file=sys.stderr)
+        exit(0 if success else 1)
     if os.path.isfile(input_path):
         source_dir = os.path.dirname(input_path)
         file_list = [os.path.basename(input_path)]
     else:
         source_dir = input_path
         file_list = os.listdir(source_dir)
+    asm_file = None
+    if args.asm:
+        if os.path.isfile(input_path):
+            asm_file = os.path.splitext(input_path)[0] + '.asm'
+        else:
+            asm_file = os.path.join(source_dir, os.path.basename(os.path.abspath(source_dir)) + '.asm')
 
-    for file in filter(lambda file: file[-5:] == ".jack", file_list):
-        handler = FileHandler(file, source_dir)
-        handler.compile()
+    file_list = sorted(filter(lambda file: file[-5:] == ".jack", file_list))
+    jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+    options = CompileOptions(peephole=args.peephole, fold_constants=args.fold_constants,
+                             string_pool=args.string_pool, optimize_control_flow=args.optimize_control_flow,
+                             whole_program=args.whole_program or args.asm,
+                             inline_size=args.inline_size if args.inline else 0,
+                             optimize_arrays=args.optimize_arrays, xml=args.xml)
+    cache = None
+    # Every file is compiled for a cost report, so it covers all of them.
+    if not args.stdout and not args.asm and not args.cost_report:
+        description = options.describe()
+        if options.whole_program:
+            # Any change to any file can change the output of every file.
+            description += f',sources={sources_hash(source_dir, file_list)}'
+        cache = BuildCache(source_dir, description)
+        if args.force:
+            cache.clear()
+    if args.watch:
+        Watcher(source_dir, options, cache, file_list[0] if os.path.isfile(input_path) else None,
+                args.interval).run()
+        exit(0)
+    total_stats = FileStats('total')
+    stats_hook = None
+    if args.stats:
+        def stats_hook(stats: FileStats):
+            print(stats.describe(), file=sys.stderr)
+            total_stats.add(stats)
+    cost_report = None
+    cost_hook = None
+    if args.cost_report:
+        cost_report = CostReport()
+        cost_hook = cost_report.merge
+    profile = None
+    if args.profile:
+        import cProfile
+        jobs = 1
+        profile = cProfile.Profile()
+        profile.enable()
+    success = compile_files(file_list, source_dir, options, jobs, cache, args.stdout, stats_hook, asm_file,
+                            cost_hook)
+    if profile is not None:
+        profile.disable()
+        profile.dump_stats(args.profile)
+    if args.stats:
+        print(total_stats.describe(), file=sys.stderr)
+    if cost_report is not None:
+        print(cost_report.describe(), file=sys.stderr)
+        with open(args.cost_report, 'w') as report_file:
+            json.dump(cost_report.to_json(), report_file, indent=2)
+    if not success:
+        exit(1)
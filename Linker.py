@@ -0,0 +1,173 @@
+import typing
+
+from VMCode import CALL, FUNCTION, OPCODE_MASK, name_of, parse, serialize
+
+ENTRY_POINT = 'Main.main'
+
+
+def split_functions(code: str) -> typing.List[typing.Tuple[str, typing.List[int]]]:
+    """
+    Split the VM code of a class into its functions.
+    :param code: VM commands separated by newlines, possibly with comments.
+    :return: the name and the commands of every function, in order.
+    """
+    functions = []
+    for text in code.split('\n'):
+        # Library code written by hand, such as the OS, may have comments and blank lines.
+        text = text.split('//', 1)[0]
+        if not text or text.isspace():
+            continue
+        line = parse(text)
+        if line & OPCODE_MASK == FUNCTION:
+            functions.append((name_of(line), [line]))
+        elif functions:
+            functions[-1][1].append(line)
+    return functions
+
+
+class Linker:
+    """
+    Link the VM code of all the classes of a program, dropping the subroutines that can never be called from its
+    entry point. Jack has no function pointers, so the calls in the VM code are the whole call graph.
+    """
+
+    def __init__(self, entry_point: str = ENTRY_POINT):
+        """
+        Create a new linker.
+        :param entry_point: the function the program starts from.
+        """
+        self.__entry_point = entry_point
+        self.__roots = []
+        self.__classes = {}
+        self.__functions = {}
+        self.__removed_functions = []
+        self.__removed_commands = 0
+
+    def add(self, name: str, code: str, keep: bool = False):
+        """
+        Add the VM code of a class to the program.
+        :param name: name of the class's output, such as its .vm file.
+        :param code: VM commands separated by newlines.
+        :param keep: keep every function of the class, and the functions they call, such as those of a .vm file that
+            is not linked but used as it is.
+        """
+        functions = split_functions(code)
+        self.__classes[name] = functions
+        for function_name, lines in functions:
+            self.__functions[function_name] = lines
+            if keep:
+                self.add_root(function_name)
+
+    def add_root(self, function_name: str):
+        """
+        Keep a function, and the functions it calls, even if the entry point never calls it, such as Sys.init, which
+        the VM bootstrap calls.
+        """
+        if function_name not in self.__roots:
+            self.__roots.append(function_name)
+
+    def get_roots(self) -> typing.List[str]:
+        """
+        :return: the entry point and the other functions that are kept with the functions they call.
+        """
+        return [self.__entry_point] + [root for root in self.__roots if root != self.__entry_point]
+
+    def get_entry_point(self) -> str:
+        """
+        :return: the function the program starts from.
+        """
+        return self.__entry_point
+
+    def set_entry_point(self, entry_point: str):
+        """
+        :param entry_point: the function the program starts from.
+        """
+        self.__entry_point = entry_point
+
+    def has_entry_point(self) -> bool:
+        """
+        :return: whether the entry point of the program was added.
+        """
+        return self.__entry_point in self.__functions
+
+    def get_removed_functions(self) -> typing.List[str]:
+        """
+        :return: names of the functions that were removed by the last link.
+        """
+        return self.__removed_functions
+
+    def get_removed_commands(self) -> int:
+        """
+        :return: the number of VM commands in the functions that were removed by the last link.
+        """
+        return self.__removed_commands
+
+    def get_functions(self) -> typing.Dict[str, typing.List[int]]:
+        """
+        :return: the VM commands of every function of the program, by name. Changing them changes the linked code.
+        """
+        return self.__functions
+
+    def get_function_count(self) -> int:
+        """
+        :return: the number of functions in the program.
+        """
+        return len(self.__functions)
+
+    def reachable(self) -> typing.Set[str]:
+        """
+        :return: names of the functions that can be called from the entry point or the other roots, including them.
+        Calls to functions outside the program, such as the OS, are ignored.
+        """
+        reachable = set()
+        pending = self.get_roots()
+        while pending:
+            function_name = pending.pop()
+            if function_name in reachable or function_name not in self.__functions:
+                continue
+            reachable.add(function_name)
+            for line in self.__functions[function_name]:
+                if line & OPCODE_MASK == CALL:
+                    pending.append(name_of(line))
+        return reachable
+
+    def get_undefined_calls(self) -> typing.List[str]:
+        """
+        :return: names of the functions that are called from the entry point, directly or not, but are not in the
+        program, in order.
+        """
+        undefined = []
+        for function_name in sorted(self.reachable()):
+            for line in self.__functions[function_name]:
+                if line & OPCODE_MASK == CALL and name_of(line) not in self.__functions \
+                        and name_of(line) not in undefined:
+                    undefined.append(name_of(line))
+        return undefined
+
+    def link(self) -> typing.Dict[str, str]:
+        """
+        Drop the functions that cannot be called from the entry point. If the program has no entry point, such as a
+        library, nothing is dropped.
+        :return: the linked VM code of every class, by name.
+        """
+        return {name: serialize(lines) for name, lines in self.link_code().items()}
+
+    def link_code(self) -> typing.Dict[str, typing.List[int]]:
+        """
+        Drop the functions that cannot be called from the entry point, like link.
+        :return: the linked VM commands of every class, by name.
+        """
+        reachable = self.reachable() if self.has_entry_point() else set(self.__functions)
+        self.__removed_functions = []
+        self.__removed_commands = 0
+        linked = {}
+        for name, functions in self.__classes.items():
+            lines = []
+            for function_name, function_lines in functions:
+                if function_name in reachable:
+                    lines += function_lines
+                else:
+                    self.__removed_functions.append(function_name)
+                    self.__removed_commands += len(function_lines)
+            linked[name] = lines
+        return linked
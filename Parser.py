@@ -1,9 +1,16 @@
+import re
 import typing
-from lxml import etree as ET
 
+if typing.TYPE_CHECKING:
+    from lxml import etree as ET
+
+from CompileOptions import CompileOptions
+from SubroutineCache import SubroutineCache
 from SymbolTable import Symbol
 from Tokenizer import *
+from VMCode import LABEL, GOTO, IF_GOTO, OPCODE_MASK, command, name_id, name_of, to_array
 from VMWriter import VMWriter
+from XmlStream import XmlStream
 
 EXPRESSION_LIST = 'expressionList'
 TERM = 'term'
@@ -14,6 +21,14 @@ IF_STATEMENT = 'ifStatement'
 EXPRESSION = 'expression'
 UNARY_OPS = '-~'
 KEYWORD_CONSTS = ['true', 'false', 'null', 'this']
+# Symbols that make an identifier the start of a term that nests other constructs.
+NESTING_SYMBOLS = ('.', '[')
+# The value of true. A condition holds only if it is exactly this value.
+TRUE_VALUE = -1
+# The numbered labels of if and while statements, which are numbered per class.
+IF_LABEL_RE = re.compile(r'^((?:FALSE|END|TRUE)_LABEL)(\d+)$')
+WHILE_LABEL_RE = re.compile(r'^(WHILE_(?:START|END|CONDITION))(\d+)$')
+JUMPS = (LABEL, GOTO, IF_GOTO)
 PERIOD = '.'
 OPS = '+-*/&|<>='
 ELSE = 'else'
@@ -25,7 +40,7 @@ IF = 'if'
 RETURN = 'return'
 WHILE = 'while'
 LET = 'let'
-DO = 'do '
+DO = 'do'
 STATEMENTS = 'statements'
 VAR_DEC = 'varDec'
 SUBROUTINE_BODY = 'subroutineBody'
@@ -49,67 +64,127 @@ STATIC = 'static'
 FIELD = 'field'
 START_BLOCK = '{'
 CLASS_KEYWORD = 'class'
+# A step of parsing statements and expressions. It yields the tasks of the constructs nested in it, is sent what
+# they return, and returns its own result.
+Task = typing.Generator['Task', typing.Any, typing.Any]
+
+
+def run(task: Task) -> typing.Any:
+    """
+    Run a parsing task and the tasks nested in it on an explicit stack instead of the Python call stack, so deeply
+    nested code never reaches the recursion limit, and takes time and memory linear in its depth.
+    :return: what the task returns.
+    """
+    stack = [task]
+    value = None
+    while stack:
+        try:
+            nested = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+            continue
+        stack.append(nested)
+        value = None
+    return value
 
 
 class Parser:
     """
     Parse a tokenized jack input into a parse tree.
+    Statements and expressions are parsed by tasks on an explicit stack, so their nesting depth is not limited by
+    the recursion limit of Python.
     """
 
-    def __init__(self, tokenizer: Tokenizer):
+    def __init__(self, tokenizer: Tokenizer, build_tree: bool = True, vm_writer: VMWriter = None,
+                 options: CompileOptions = None, subroutine_cache: SubroutineCache = None,
+                 xml_stream: XmlStream = None):
         """
         Create a new parser over a token stream of jack input.
+        :param tokenizer: the token stream to parse.
+        :param build_tree: whether to build the parse tree. Without it VM code is emitted straight to the VMWriter,
+            and lxml is never imported.
+        :param vm_writer: the writer to emit VM code to, by default one that keeps the code in memory.
+        :param options: options to compile with, the defaults if not given.
+        :param subroutine_cache: the subroutines of the previous compilation of the class, to reuse the code of
+            those that did not change. It must not be used with a parse tree or with a string pool, whose code
+            depends on the other subroutines.
+        :param xml_stream: a stream to write the parse tree to as it is parsed, instead of building it. It is used
+            without build_tree.
         """
         self.__tokenizer = tokenizer
-        self.__vm_writer = VMWriter()
+        self.__xml_stream = xml_stream
+        self.__etree = None
+        if build_tree:
+            from lxml import etree
+            self.__etree = etree
+        self.__vm_writer = vm_writer if vm_writer is not None else VMWriter()
+        self.__options = options if options is not None else CompileOptions()
+        self.__subroutine_cache = subroutine_cache
         self.__class_name = ""
+        self.__class_vars = []
         self.__if_counter = 0
         self.__while_counter = 0
 
-    def parse(self) -> typing.List[str]:
+    def parse(self) -> typing.List[int]:
         """
         Parse the token stream until there are no more tokens to parse.
-        :return: ElementTree representing the parseTree
+        :return: the VM commands that were not flushed to the sink of the VM writer.
         """
 
-        new_element = ET.Element('ROOT')
+        new_element = self.__etree.Element('ROOT') if self.__etree is not None else None
+        if self.__xml_stream is not None:
+            new_element = self.__xml_stream.get_root()
         try:
             self.__compile_class(new_element)
         except RuntimeError as e:
             print(e)
-            print("Dumping Tree:\n")
-            ET.dump(new_element[0])
+            if self.__etree is not None:
+                print("Dumping Tree:\n")
+                self.__etree.dump(new_element[0])
         # tree = ET.ElementTree(new_element[0])
-
+        self.__vm_writer.flush()
         return self.__vm_writer.get_lines()
 
-    def __compile_symbol(self, element: ET.Element, string):
+    def __add_element(self, element: typing.Optional['ET.Element'], tag: str, text: str = None):
+        """
+        Append a new node to the parse tree.
+        :param element: the parent node, or None when no tree is being built.
+        :param tag: tag of the new node.
+        :param text: text of the new node.
+        :return: the new node, or None when no tree is being built.
+        """
+        if element is None:
+            return None
+        if self.__xml_stream is not None:
+            new_element = self.__xml_stream.add(element, tag)
+        else:
+            new_element = self.__etree.SubElement(element, tag)
+        if text is not None:
+            new_element.text = text
+        return new_element
+
+    def __compile_symbol(self, element: 'ET.Element', string):
         self.__tokenizer.eat(string)
-        new_element = ET.Element(SYMBOL)
-        new_element.text = string
-        element.append(new_element)
+        self.__add_element(element, SYMBOL, string)
         return string
 
-    def __compile_identifier(self, element: ET.Element):
+    def __compile_identifier(self, element: 'ET.Element'):
         token = self.__tokenizer.next_token()
-        assert token.get_type() == IDENTIFIER, "Token type is: " + token.get_type() \
-                                               + ", Token is: " + token.get_content()
-        new_element = ET.Element(IDENTIFIER)
-        new_element.text = token.get_content()
-        element.append(new_element)
+        assert token.get_kind() == IDENTIFIER_KIND, "Token type is: " + token.get_type() \
+                                                    + ", Token is: " + token.get_content()
+        self.__add_element(element, IDENTIFIER, token.get_content())
         return token.get_content()
 
-    def __compile_keyword(self, element: ET.Element):
+    def __compile_keyword(self, element: 'ET.Element'):
         token = self.__tokenizer.next_token()
-        assert token.get_type() == KEYWORD, "Token type is: " + token.get_type() + ", Token is: " + token.get_content()
-        new_element = ET.Element(KEYWORD)
-        new_element.text = token.get_content()
-        element.append(new_element)
+        assert token.get_kind() == KEYWORD_KIND, "Token type is: " + token.get_type() \
+                                                 + ", Token is: " + token.get_content()
+        self.__add_element(element, KEYWORD, token.get_content())
         return token.get_content()
 
-    def __compile_class(self, element: ET.Element):
-        new_element = ET.Element(CLASS_TAG)
-        element.append(new_element)
+    def __compile_class(self, element: 'ET.Element'):
+        new_element = self.__add_element(element, CLASS_TAG)
         self.__compile_keyword(new_element)  # Class keyword
         self.__class_name = self.__compile_identifier(new_element)  # Class var name
         self.__compile_symbol(new_element, START_BLOCK)
@@ -118,13 +193,17 @@ class Parser:
             self.__compile_class_var_dec(new_element)
             next_token = self.__tokenizer.peek().get_content()
         while next_token == CONSTRUCTOR or next_token == FUNCTION or next_token == METHOD:
-            self.__compile__subroutine_dec(new_element)
+            if self.__subroutine_cache is not None:
+                self.__compile_cached_subroutine_dec(new_element)
+            else:
+                self.__compile__subroutine_dec(new_element)
             next_token = self.__tokenizer.peek().get_content()
         self.__compile_symbol(new_element, END_BLOCK)
+        self.__vm_writer.write_string_pool(self.__class_name)
+        self.__vm_writer.flush()
 
     def __compile_class_var_dec(self, element):
-        new_element = ET.Element(CLASS_VAR_DEC)
-        element.append(new_element)
+        new_element = self.__add_element(element, CLASS_VAR_DEC)
         var_names = []
         kind = self.__compile_keyword(new_element)
         type_of = self.__compile_type(new_element)
@@ -137,12 +216,13 @@ class Parser:
         self.__compile_symbol(new_element, SEMICOLON)
         for var in var_names:
             self.__vm_writer.declare_var(var, kind, type_of)
+            self.__class_vars.append((var, kind, type_of))
 
     def __compile_type(self, element):
         next_token = self.__tokenizer.peek()
-        if next_token.get_type() == IDENTIFIER:
+        if next_token.get_kind() == IDENTIFIER_KIND:
             return self.__compile_identifier(element)
-        elif next_token.get_type() == KEYWORD:
+        elif next_token.get_kind() == KEYWORD_KIND:
             return self.__compile_keyword(element)
         else:
             raise RuntimeError(
@@ -151,8 +231,7 @@ class Parser:
 
     def __compile__subroutine_dec(self, element):
         func_name = self.__class_name + '.'
-        new_element = ET.Element(SUBROUTINE_DEC)
-        element.append(new_element)
+        new_element = self.__add_element(element, SUBROUTINE_DEC)
         kind = self.__compile_keyword(new_element)
         if self.__tokenizer.peek().get_content() == VOID:
             type_of = self.__compile_keyword(new_element)
@@ -166,13 +245,52 @@ class Parser:
         args += self.__compile_parameter_list(new_element)
         self.__compile_symbol(new_element, CLOSE_PAR)
 
-        self.__compile_subroutine_body(new_element, func_name, args, type_of, kind)
+        return self.__compile_subroutine_body(new_element, func_name, args, type_of, kind)
+
+    def __compile_cached_subroutine_dec(self, element):
+        """
+        Compile a subroutine, or reuse its code from the subroutine cache if it was compiled before from the same
+        tokens and with the same class variables. Its labels are renumbered to follow the labels of this compilation.
+        """
+        tokens = self.__tokenizer.peek_block()
+        key = (self.__class_name, tuple(self.__class_vars),
+               tuple((token.get_kind(), token.get_content()) for token in tokens))
+        entry = self.__subroutine_cache.look_up(key)
+        if entry is None:
+            if_start = self.__if_counter
+            while_start = self.__while_counter
+            lines = self.__compile__subroutine_dec(element)
+            self.__subroutine_cache.store(key, (to_array(lines), if_start, while_start,
+                                                self.__if_counter - if_start, self.__while_counter - while_start))
+            return
+        lines, if_start, while_start, if_count, while_count = entry
+        if_shift = self.__if_counter - if_start
+        while_shift = self.__while_counter - while_start
+        if if_shift or while_shift:
+            lines = [self.__renumber_labels(line, if_shift, while_shift) for line in lines]
+        self.__if_counter += if_count
+        self.__while_counter += while_count
+        for _ in tokens:
+            self.__tokenizer.next_token()
+        self.__vm_writer.write_flushed(lines)
+
+    @staticmethod
+    def __renumber_labels(line: int, if_shift: int, while_shift: int) -> int:
+        """
+        Add to the numbers of the if and while labels in a VM command.
+        """
+        opcode = line & OPCODE_MASK
+        if opcode not in JUMPS:
+            return line
+        name = IF_LABEL_RE.sub(lambda match: match.group(1) + str(int(match.group(2)) + if_shift), name_of(line))
+        name = WHILE_LABEL_RE.sub(lambda match: match.group(1) + str(int(match.group(2)) + while_shift), name)
+        return command(opcode, 0, name_id(name))
 
     def __compile_parameter_list(self, element) -> typing.List[typing.Tuple[str, str]]:
-        new_element = ET.Element(PARAMETER_LIST)
-        element.append(new_element)
+        new_element = self.__add_element(element, PARAMETER_LIST)
         if self.__tokenizer.peek().get_content() == CLOSE_PAR:
-            new_element.text = '\n'
+            if new_element is not None:
+                new_element.text = '\n'
             return []
         args = []
         type_of = self.__compile_type(new_element)
@@ -188,8 +306,7 @@ class Parser:
         return args
 
     def __compile_subroutine_body(self, element, func_name, args,  type_of: str, kind: str):
-        new_element = ET.Element(SUBROUTINE_BODY)
-        element.append(new_element)
+        new_element = self.__add_element(element, SUBROUTINE_BODY)
         self.__vm_writer.start_subroutine()
         self.__compile_symbol(new_element, START_BLOCK)
         is_void = type_of == VOID
@@ -201,12 +318,12 @@ class Parser:
             self.__vm_writer.write_set_this()
         if kind == CONSTRUCTOR:
             self.__vm_writer.write_constructor_alloc()
-        self.__compile_statements(new_element, is_void)
+        run(self.__compile_statements(new_element, is_void))
         self.__compile_symbol(new_element, END_BLOCK)
+        return self.__vm_writer.flush()
 
     def __compile_var_dec(self, element) -> int:
-        new_element = ET.Element(VAR_DEC)
-        element.append(new_element)
+        new_element = self.__add_element(element, VAR_DEC)
         self.__compile_keyword(new_element)
         var_names = []
         type_of = self.__compile_type(new_element)
@@ -221,71 +338,110 @@ class Parser:
             self.__vm_writer.declare_var(var, Symbol.LOCAL, type_of)
         return len(var_names)
 
-    def __compile_statements(self, element: ET.Element, is_void: bool = False):
-        new_element = ET.Element(STATEMENTS)
-        element.append(new_element)
+    def __compile_statements(self, element: 'ET.Element', is_void: bool = False) -> Task:
+        new_element = self.__add_element(element, STATEMENTS)
         next_token = self.__tokenizer.peek().get_content()
-        while self.__tokenizer.peek().get_type() == KEYWORD:
+        while self.__tokenizer.peek().get_kind() == KEYWORD_KIND:
             if next_token == DO:
-                self.__compile_do(new_element)
+                yield self.__compile_do(new_element)
             elif next_token == LET:
-                self.__compile_let(new_element)
+                yield self.__compile_let(new_element)
             elif next_token == WHILE:
-                self.__compile_while(new_element)
+                yield self.__compile_while(new_element)
             elif next_token == RETURN:
-                self.__compile_return(new_element, is_void)
+                yield self.__compile_return(new_element, is_void)
             elif next_token == IF:
-                self.__compile_if(new_element)
+                yield self.__compile_if(new_element)
             else:
-                if not new_element:
+                if new_element is not None and not len(new_element):
                     new_element.text = '\n'
                 return
             next_token = self.__tokenizer.peek().get_content()
 
     def __compile_let(self, element):
-        new_element = ET.Element(LET_STATEMENT)
-        element.append(new_element)
+        new_element = self.__add_element(element, LET_STATEMENT)
         self.__compile_keyword(new_element)
         var_name = self.__compile_identifier(new_element)
-        if self.__tokenizer.peek().get_content() == OPEN_BRACKETS:
+        if self.__tokenizer.peek().get_content() == OPEN_BRACKETS and self.__options.optimize_arrays:
+            yield self.__compile_optimized_array_let(new_element, var_name)
+        elif self.__tokenizer.peek().get_content() == OPEN_BRACKETS:
 
             self.__vm_writer.write_push_var(var_name)
 
             self.__compile_symbol(new_element, OPEN_BRACKETS)
-            self.__compile_expression(new_element)
+            yield self.__compile_expression(new_element)
             self.__compile_symbol(new_element, CLOSE_BRACKETS)
 
             self.__vm_writer.write_arithmetic('+')
 
             self.__compile_symbol(new_element, EQUALS)
-            self.__compile_expression(new_element)
+            yield self.__compile_expression(new_element)
             self.__compile_symbol(new_element, SEMICOLON)
 
             self.__vm_writer.write_access_array()
         else:
 
             self.__compile_symbol(new_element, EQUALS)
-            self.__compile_expression(new_element)
+            yield self.__compile_expression(new_element)
             self.__compile_symbol(new_element, SEMICOLON)
             self.__vm_writer.write_pop_var(var_name)
 
+    def __compile_optimized_array_let(self, element, var_name: str):
+        """
+        Compile an assignment to an array element. If the right hand side cannot change pointer 1, it is set to the
+        address before the right hand side is computed, and the value is popped straight into the element.
+        """
+        index = yield self.__compile_array_address(element, var_name)
+        self.__compile_symbol(element, EQUALS)
+        value = self.__vm_writer.mark()
+        yield self.__compile_expression(element)
+        self.__compile_symbol(element, SEMICOLON)
+        if self.__vm_writer.keeps_that(value):
+            self.__vm_writer.write_set_that(value)
+            self.__vm_writer.write_pop_that(index)
+        else:
+            self.__vm_writer.write_access_array(index)
+
+    def __compile_array_address(self, element, var_name: str) -> Task:
+        """
+        Compile the address of an array element, up to the closing bracket. A constant index is not added to the
+        address of the array, but returned to address the element through the that segment.
+        :return: a task that returns the offset of the element from the address.
+        """
+        self.__vm_writer.write_push_var(var_name)
+        self.__compile_symbol(element, OPEN_BRACKETS)
+        index = self.__vm_writer.mark()
+        yield self.__compile_expression(element)
+        self.__compile_symbol(element, CLOSE_BRACKETS)
+        constant = self.__vm_writer.constant_value(index)
+        if constant is not None and constant >= 0:
+            self.__vm_writer.take(index)
+            return constant
+        self.__vm_writer.write_arithmetic('+')
+        return 0
+
     def __compile_expression(self, element):
-        new_element = ET.Element(EXPRESSION)
-        element.append(new_element)
-        self.__compile_term(new_element)
+        new_element = self.__add_element(element, EXPRESSION)
+        left = self.__vm_writer.mark()
+        if not self.__compile_simple_term(new_element):
+            yield self.__compile_term(new_element)
         next_token = self.__tokenizer.peek().get_content()
         while next_token in OPS:
             op = self.__compile_symbol(new_element, next_token)
-            self.__compile_term(new_element)
+            right = self.__vm_writer.mark()
+            if not self.__compile_simple_term(new_element):
+                yield self.__compile_term(new_element)
             next_token = self.__tokenizer.peek().get_content()
-            self.__vm_writer.write_arithmetic(op)
+            self.__vm_writer.write_binary_arithmetic(op, left, right)
 
     def __compile_if(self, element):
-        new_element = ET.Element(IF_STATEMENT)
-        element.append(new_element)
+        if self.__options.optimize_control_flow:
+            yield self.__compile_optimized_if(element)
+            return
+        new_element = self.__add_element(element, IF_STATEMENT)
         self.__compile_keyword(new_element)
         self.__compile_symbol(new_element, OPEN_PAR)
-        self.__compile_expression(new_element)
+        yield self.__compile_expression(new_element)
         self.__vm_writer.write_arithmetic('~', unary=True)
         if_end_label = f"END_LABEL{self.__if_counter}"
         if_false_label = f"FALSE_LABEL{self.__if_counter}"
@@ -293,47 +449,153 @@ class Parser:
         self.__vm_writer.write_if_goto(if_false_label)
         self.__compile_symbol(new_element, CLOSE_PAR)
         self.__compile_symbol(new_element, START_BLOCK)
-        self.__compile_statements(new_element)
+        yield self.__compile_statements(new_element)
         self.__compile_symbol(new_element, END_BLOCK)
         self.__vm_writer.write_goto(if_end_label)
         self.__vm_writer.write_label(if_false_label)
         if self.__tokenizer.peek().get_content() == ELSE:
             self.__compile_keyword(new_element)
             self.__compile_symbol(new_element, START_BLOCK)
-            self.__compile_statements(new_element)
+            yield self.__compile_statements(new_element)
             self.__compile_symbol(new_element, END_BLOCK)
         self.__vm_writer.write_label(if_end_label)
 
+    def __compile_optimized_if(self, element):
+        """
+        Compile an if statement without negating its condition: a condition is negated in place when that is free,
+        and otherwise a boolean condition jumps to the then branch, placed after the else branch. With a constant
+        condition only the branch that runs is kept.
+        """
+        new_element = self.__add_element(element, IF_STATEMENT)
+        self.__compile_keyword(new_element)
+        self.__compile_symbol(new_element, OPEN_PAR)
+        condition = self.__vm_writer.mark()
+        yield self.__compile_expression(new_element)
+        self.__compile_symbol(new_element, CLOSE_PAR)
+        if_end_label = f"END_LABEL{self.__if_counter}"
+        if_false_label = f"FALSE_LABEL{self.__if_counter}"
+        if_true_label = f"TRUE_LABEL{self.__if_counter}"
+        self.__if_counter += 1
+        constant = self.__vm_writer.constant_value(condition)
+        if constant is not None:
+            self.__vm_writer.take(condition)
+        negated = constant is None and self.__vm_writer.negate_condition(condition)
+        boolean = constant is None and not negated and self.__vm_writer.is_boolean(condition)
+
+        # The jump over the then branch is written before it, so the branch is written in place. It is only moved if
+        # there turns out to be an else branch that a boolean condition can jump over instead.
+        jump_start = self.__vm_writer.mark()
+        if constant is None:
+            if not negated:
+                self.__vm_writer.write_arithmetic('~', unary=True)
+            self.__vm_writer.write_if_goto(if_false_label)
+        then_start = self.__vm_writer.mark()
+        self.__compile_symbol(new_element, START_BLOCK)
+        yield self.__compile_statements(new_element)
+        self.__compile_symbol(new_element, END_BLOCK)
+        has_else = self.__tokenizer.peek().get_content() == ELSE
+        else_first = has_else and boolean
+
+        then_lines = None
+        if constant is not None:
+            if constant != TRUE_VALUE:
+                self.__vm_writer.take(then_start)
+        elif else_first:
+            then_lines = self.__vm_writer.take(then_start)
+            self.__vm_writer.take(jump_start)
+            self.__vm_writer.write_if_goto(if_true_label)
+        else:
+            if has_else:
+                self.__vm_writer.write_goto(if_end_label)
+            self.__vm_writer.write_label(if_false_label)
+
+        if has_else:
+            else_start = self.__vm_writer.mark()
+            self.__compile_keyword(new_element)
+            self.__compile_symbol(new_element, START_BLOCK)
+            yield self.__compile_statements(new_element)
+            self.__compile_symbol(new_element, END_BLOCK)
+            if constant == TRUE_VALUE:
+                self.__vm_writer.take(else_start)
+            elif else_first:
+                self.__vm_writer.write_goto(if_end_label)
+                self.__vm_writer.write_label(if_true_label)
+                self.__vm_writer.write_lines(then_lines)
+                self.__vm_writer.write_label(if_end_label)
+            elif constant is None:
+                self.__vm_writer.write_label(if_end_label)
+
     def __compile_while(self, element):
-        new_element = ET.Element(WHILE_STATEMENT)
+        if self.__options.optimize_control_flow:
+            yield self.__compile_optimized_while(element)
+            return
         while_label = f'WHILE_START{self.__while_counter}'
         end_label = f'WHILE_END{self.__while_counter}'
         self.__while_counter += 1
-        element.append(new_element)
+        new_element = self.__add_element(element, WHILE_STATEMENT)
         self.__compile_keyword(new_element)
 
         self.__vm_writer.write_label(while_label)
 
         self.__compile_symbol(new_element, OPEN_PAR)
-        self.__compile_expression(new_element)
+        yield self.__compile_expression(new_element)
 
         self.__vm_writer.write_arithmetic('~', unary=True)
         self.__vm_writer.write_if_goto(end_label)
 
         self.__compile_symbol(new_element, CLOSE_PAR)
         self.__compile_symbol(new_element, START_BLOCK)
-        self.__compile_statements(new_element)
+        yield self.__compile_statements(new_element)
 
         self.__vm_writer.write_goto(while_label)
         self.__vm_writer.write_label(end_label)
 
         self.__compile_symbol(new_element, END_BLOCK)
 
+    def __compile_optimized_while(self, element):
+        """
+        Compile a while statement with a boolean condition after its body, so each iteration runs a single
+        conditional jump and no 'not'. A loop whose condition is a constant either needs no condition or is dropped.
+        """
+        while_label = f'WHILE_START{self.__while_counter}'
+        condition_label = f'WHILE_CONDITION{self.__while_counter}'
+        end_label = f'WHILE_END{self.__while_counter}'
+        self.__while_counter += 1
+        new_element = self.__add_element(element, WHILE_STATEMENT)
+        self.__compile_keyword(new_element)
+        self.__compile_symbol(new_element, OPEN_PAR)
+        condition = self.__vm_writer.mark()
+        yield self.__compile_expression(new_element)
+        self.__compile_symbol(new_element, CLOSE_PAR)
+        constant = self.__vm_writer.constant_value(condition)
+        rotate = constant is None and self.__vm_writer.is_boolean(condition)
+        condition_lines = self.__vm_writer.take(condition)
+
+        if rotate:
+            self.__vm_writer.write_goto(condition_label)
+        self.__vm_writer.write_label(while_label)
+        if constant is None and not rotate:
+            self.__vm_writer.write_lines(condition_lines)
+            self.__vm_writer.write_arithmetic('~', unary=True)
+            self.__vm_writer.write_if_goto(end_label)
+        self.__compile_symbol(new_element, START_BLOCK)
+        yield self.__compile_statements(new_element)
+        self.__compile_symbol(new_element, END_BLOCK)
+        if rotate:
+            self.__vm_writer.write_label(condition_label)
+            self.__vm_writer.write_lines(condition_lines)
+            self.__vm_writer.write_if_goto(while_label)
+        elif constant is None or constant == TRUE_VALUE:
+            self.__vm_writer.write_goto(while_label)
+            if constant is None:
+                self.__vm_writer.write_label(end_label)
+        else:
+            self.__vm_writer.take(condition)
+
     def __compile_do(self, element):
-        new_element = ET.Element(DO_STATEMENT)
-        element.append(new_element)
+        new_element = self.__add_element(element, DO_STATEMENT)
         self.__compile_keyword(new_element)
-        self.__compile_subroutine_call(new_element)
+        yield self.__compile_subroutine_call(new_element)
         self.__vm_writer.write_pop_temp()
         self.__compile_symbol(new_element, SEMICOLON)
 
@@ -345,7 +607,7 @@ class Parser:
             func_name = self.__class_name + '.' + func_name
             self.__compile_symbol(new_element, OPEN_PAR)
             self.__vm_writer.write_push_keyword_constant('this')
-            num_args = self.__compile_expression_list(new_element) + 1
+            num_args = (yield self.__compile_expression_list(new_element)) + 1
             self.__compile_symbol(new_element, CLOSE_PAR)
         elif next_token == PERIOD:
             name = func_name
@@ -359,86 +621,102 @@ class Parser:
                 self.__vm_writer.write_push_var(name)
                 num_args = 1
                 func_name = f'{type_of_obj}.{identifier}'
-            num_args += self.__compile_expression_list(new_element)
+            num_args += yield self.__compile_expression_list(new_element)
             self.__compile_symbol(new_element, CLOSE_PAR)
         else:
             raise RuntimeError(f'Something went wrong when calling function: {func_name}')
         self.__vm_writer.write_call(func_name, num_args)
 
     def __compile_return(self, element, is_void: bool):
-        new_element = ET.Element(RETURN_STATEMENT)
-        element.append(new_element)
+        new_element = self.__add_element(element, RETURN_STATEMENT)
         self.__compile_keyword(new_element)
         next_token = self.__tokenizer.peek().get_content()
         if next_token != SEMICOLON:
-            self.__compile_expression(new_element)
+            yield self.__compile_expression(new_element)
         self.__compile_symbol(new_element, SEMICOLON)
         if is_void:
             self.__vm_writer.write_push_int_constant('0')
         self.__vm_writer.write_return()
 
-    def __compile_term(self, element):
-        new_element = ET.Element(TERM)
-        element.append(new_element)
+    def __compile_simple_term(self, element) -> bool:
+        """
+        Compile the next term right away, without a task, if it nests no other construct, such as a constant or a
+        variable.
+        :return: whether the term was simple and was compiled.
+        """
         next_token = self.__tokenizer.peek()
-        if next_token.get_type() == INTEGER_CONSTANT:
-            newer_element = ET.Element(INTEGER_CONSTANT)
+        kind = next_token.get_kind()
+        if kind == IDENTIFIER_KIND:
+            if self.__tokenizer.peek(2).get_content() in NESTING_SYMBOLS:
+                return False
+        elif kind != INTEGER_CONSTANT_KIND and kind != STRING_CONSTANT_KIND \
+                and next_token.get_content() not in KEYWORD_CONSTS:
+            return False
+        new_element = self.__add_element(element, TERM)
+        if kind == INTEGER_CONSTANT_KIND:
             constant = self.__tokenizer.next_token().get_content()
-            newer_element.text = constant
-            new_element.append(newer_element)
+            self.__add_element(new_element, INTEGER_CONSTANT, constant)
             self.__vm_writer.write_push_int_constant(constant)
-        elif next_token.get_type() == STRING_CONSTANT:
-            newer_element = ET.Element(STRING_CONSTANT)
-            newer_element.text = self.__tokenizer.next_token().get_content()[1:-1]
-            new_element.append(newer_element)
+        elif kind == STRING_CONSTANT_KIND:
+            self.__add_element(new_element, STRING_CONSTANT, self.__tokenizer.next_token().get_content()[1:-1])
             self.__vm_writer.write_push_string_constant(next_token.get_content()[1:-1])
-        elif next_token.get_content() in KEYWORD_CONSTS:
+        elif kind == IDENTIFIER_KIND:
+            self.__vm_writer.write_push_var(self.__compile_identifier(new_element))
+        else:
             self.__compile_keyword(new_element)
             self.__vm_writer.write_push_keyword_constant(next_token.get_content())
-        elif next_token.get_type() == IDENTIFIER:
-            if next_token.get_next_char() == PERIOD:
-                self.__compile_subroutine_call(new_element)
+        return True
+
+    def __compile_term(self, element):
+        if self.__compile_simple_term(element):
+            return
+        new_element = self.__add_element(element, TERM)
+        next_token = self.__tokenizer.peek()
+        if next_token.get_kind() == IDENTIFIER_KIND:
+            if self.__tokenizer.peek(2).get_content() == PERIOD:
+                yield self.__compile_subroutine_call(new_element)
                 return
             var_name = self.__compile_identifier(new_element)
-            next_token = self.__tokenizer.peek()
-            if next_token.get_content() == OPEN_BRACKETS:
+            if self.__options.optimize_arrays:
+                index = yield self.__compile_array_address(new_element, var_name)
+                self.__vm_writer.write_get_array(index)
+            else:
                 self.__vm_writer.write_push_var(var_name)
                 self.__compile_symbol(new_element, OPEN_BRACKETS)
-                self.__compile_expression(new_element)
+                yield self.__compile_expression(new_element)
                 self.__compile_symbol(new_element, CLOSE_BRACKETS)
                 self.__vm_writer.write_arithmetic('+')
                 self.__vm_writer.write_get_array()
-            else:
-                self.__vm_writer.write_push_var(var_name)
         elif next_token.get_content() in UNARY_OPS:
             op = self.__compile_symbol(new_element, next_token.get_content())
-            self.__compile_term(new_element)
+            if not self.__compile_simple_term(new_element):
+                yield self.__compile_term(new_element)
             self.__vm_writer.write_arithmetic(op, unary=True)
         elif next_token.get_content() == OPEN_PAR:
             self.__compile_symbol(new_element, OPEN_PAR)
-            self.__compile_expression(new_element)
+            yield self.__compile_expression(new_element)
             self.__compile_symbol(new_element, CLOSE_PAR)
 
-    def __compile_expression_list(self, element) -> int:
-        new_element = ET.Element(EXPRESSION_LIST)
+    def __compile_expression_list(self, element) -> Task:
+        new_element = self.__add_element(element, EXPRESSION_LIST)
         expression_num = 0
-        element.append(new_element)
         next_token = self.__tokenizer.peek()
         if self.__is_term(next_token):
-            self.__compile_expression(new_element)
+            yield self.__compile_expression(new_element)
             expression_num += 1
         else:
-            new_element.text = '\n'
+            if new_element is not None:
+                new_element.text = '\n'
             return expression_num
         next_token = self.__tokenizer.peek()
         while next_token.get_content() == COMMA:
             self.__compile_symbol(new_element, COMMA)
-            self.__compile_expression(new_element)
+            yield self.__compile_expression(new_element)
             expression_num += 1
             next_token = self.__tokenizer.peek()
         return expression_num
 
     def __is_term(self, token: Token):
-        return (token.get_type() == STRING_CONSTANT or token.get_type() == INTEGER_CONSTANT
-                or token.get_content() in KEYWORD_CONSTS or token.get_type() == IDENTIFIER
+        return (token.get_kind() == STRING_CONSTANT_KIND or token.get_kind() == INTEGER_CONSTANT_KIND
+                or token.get_content() in KEYWORD_CONSTS or token.get_kind() == IDENTIFIER_KIND
                 or token.get_content() in UNARY_OPS or token.get_content() == OPEN_PAR)
@@ -0,0 +1,84 @@
+import typing
+
+from VMCode import PUSH, POP, ADD, SUB, OR, NOT, NEG, LABEL, GOTO, IF_GOTO, OPCODE_MASK, COMMAND_MASK, \
+    push_constant, call, with_opcode, keep_names
+
+PUSH_FALSE = push_constant(0)
+PUSH_ONE = push_constant(1)
+# Operations that leave their left operand unchanged when the right operand is 0.
+ZERO_IDENTITIES = {ADD, SUB, OR}
+# Operations that leave their left operand unchanged when the right operand is 1.
+ONE_IDENTITIES = {call('Math.multiply', 2), call('Math.divide', 2)}
+# Unary operations that cancel themselves out when applied twice.
+INVOLUTIONS = {NOT, NEG}
+keep_names()
+
+
+class PeepholeOptimizer:
+    """
+    Rewrite short windows of VM commands into shorter equivalent sequences.
+    """
+
+    def __init__(self):
+        """
+        Create a new peephole optimizer.
+        """
+        self.__removed = 0
+
+    def get_removed(self) -> int:
+        """
+        :return: the number of commands removed by all the calls to optimize so far.
+        """
+        return self.__removed
+
+    def optimize(self, lines: typing.List[int]) -> typing.List[int]:
+        """
+        Optimize the VM commands of a subroutine. Each command is pushed onto the output and the end of the output
+        is rewritten until no pattern matches, so a rewrite that exposes another pattern is applied in the same pass.
+        :param lines: the VM commands to optimize.
+        :return: the optimized VM commands.
+        """
+        output = []
+        for line in lines:
+            output.append(line)
+            while self.__rewrite(output):
+                pass
+        self.__removed += len(lines) - len(output)
+        return output
+
+    @staticmethod
+    def __rewrite(output: typing.List[int]) -> bool:
+        """
+        Apply a single rewrite to the end of the output.
+        :return: whether a rewrite was applied.
+        """
+        if len(output) < 2:
+            return False
+        last = output[-1]
+        previous = output[-2]
+        last_opcode = last & OPCODE_MASK
+        if last_opcode == POP and previous == with_opcode(last, PUSH):
+            # Popping a value back to where it was just pushed from.
+            del output[-2:]
+        elif last in INVOLUTIONS and previous == last:
+            del output[-2:]
+        elif last in ZERO_IDENTITIES and previous == PUSH_FALSE:
+            del output[-2:]
+        elif last in ONE_IDENTITIES and previous == PUSH_ONE:
+            del output[-2:]
+        elif last == NEG and previous == PUSH_FALSE:
+            del output[-1]
+        elif last_opcode == IF_GOTO and previous == PUSH_FALSE:
+            # A jump that is never taken.
+            del output[-2:]
+        elif last_opcode == IF_GOTO and previous & COMMAND_MASK == PUSH:
+            # A jump that is always taken.
+            output[-2:] = [with_opcode(last, GOTO)]
+        elif last_opcode == IF_GOTO and previous == NOT and len(output) > 2 and output[-3] == PUSH_FALSE:
+            output[-3:] = [with_opcode(last, GOTO)]
+        elif last_opcode == LABEL and previous == with_opcode(last, GOTO):
+            # A jump to the next command.
+            del output[-2]
+        else:
+            return False
+        return True
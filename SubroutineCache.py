@@ -0,0 +1,65 @@
+import array
+import typing
+
+# The VM code of a compiled subroutine, packed in an array, the if and while label counters of its class before it,
+# and the number of if and while statements in it.
+Entry = typing.Tuple[array.array, int, int, int, int]
+
+
+class SubroutineCache:
+    """
+    The VM code of the subroutines of a class from its previous compilation, so subroutines that did not change can
+    be reused instead of compiled again. A subroutine is reused only when its tokens and the class variables are the
+    same, so its code, once its labels are renumbered, is exactly what compiling it would give.
+    """
+
+    def __init__(self):
+        """
+        Create an empty subroutine cache.
+        """
+        self.__entries = {}
+        self.__previous_entries = {}
+        self.__hits = 0
+        self.__misses = 0
+
+    def start(self):
+        """
+        Start a new compilation of the class. Subroutines that are not reused or compiled again by it are forgotten.
+        """
+        self.__previous_entries = self.__entries
+        self.__entries = {}
+        self.__hits = 0
+        self.__misses = 0
+
+    def get_hits(self) -> int:
+        """
+        :return: the number of subroutines reused by the current compilation.
+        """
+        return self.__hits
+
+    def get_misses(self) -> int:
+        """
+        :return: the number of subroutines compiled by the current compilation.
+        """
+        return self.__misses
+
+    def look_up(self, key: typing.Hashable) -> typing.Optional[Entry]:
+        """
+        :param key: the key of a subroutine.
+        :return: the cached code of the subroutine, or None if it has to be compiled.
+        """
+        entry = self.__entries.get(key, self.__previous_entries.get(key))
+        if entry is None:
+            self.__misses += 1
+            return None
+        self.__entries[key] = entry
+        self.__hits += 1
+        return entry
+
+    def store(self, key: typing.Hashable, entry: Entry):
+        """
+        Cache the code of a compiled subroutine.
+        :param key: the key of the subroutine.
+        :param entry: the code of the subroutine and its label counters.
+        """
+        self.__entries[key] = entry
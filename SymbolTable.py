@@ -1,9 +1,20 @@
 import typing
 
+from VMCode import THIS, STATIC, LOCAL, ARGUMENT, push, pop
+
+# Integer codes of the kinds of symbols, indexing KIND_SEGMENTS and the kind counts of a symbol table.
+FIELD_CODE = 0
+STATIC_CODE = 1
+LOCAL_CODE = 2
+ARGS_CODE = 3
+KIND_SEGMENTS = ('this', 'static', 'local', 'argument')
+KIND_SEGMENT_CODES = (THIS, STATIC, LOCAL, ARGUMENT)
+
 
 class Symbol:
     """
     Represent a single JACK symbol, including name, it's type, kind and index.
+    The segment and the push and pop commands of the symbol are resolved once, when it is registered.
     """
 
     # KIND:
@@ -11,12 +22,15 @@ class Symbol:
     STATIC = 'static'
     LOCAL = 'local'
     ARGS = 'argument'
+    KIND_CODES = {FIELD: FIELD_CODE, STATIC: STATIC_CODE, LOCAL: LOCAL_CODE, ARGS: ARGS_CODE}
+
+    __slots__ = ('__name', '__type', '__kind', '__index', '__push_command', '__pop_command')
 
-    def __init__(self, name: str, kind: str, type_of: str, index: int):
+    def __init__(self, name: str, kind: int, type_of: str, index: int):
         """
         Create new symbol with the following details.
         :param name: name of the symbol.
-        :param kind: kind of the symbol.
+        :param kind: code of the kind of the symbol.
         :param type_of: type of the symbol.
         :param index: index of the symbol in segment.
         """
@@ -24,10 +38,13 @@ class Symbol:
         self.__type = type_of
         self.__kind = kind
         self.__index = index
+        self.__push_command = push(KIND_SEGMENT_CODES[kind], index)
+        self.__pop_command = pop(KIND_SEGMENT_CODES[kind], index)
 
     def get_segment(self):
-        if self.__kind == Symbol.FIELD:
-            return 'this'
+        return KIND_SEGMENTS[self.__kind]
+
+    def get_kind(self) -> int:
         return self.__kind
 
     def get_index(self):
@@ -36,6 +53,12 @@ class Symbol:
     def get_type(self):
         return self.__type
 
+    def get_push_command(self) -> int:
+        return self.__push_command
+
+    def get_pop_command(self) -> int:
+        return self.__pop_command
+
 
 class SymbolTable:
     """
@@ -48,7 +71,7 @@ class SymbolTable:
         """
         self.__class_table = {}
         self.__subroutine_table = {}
-        self.__kind_count = {Symbol.ARGS: 0, Symbol.FIELD: 0, Symbol.LOCAL: 0, Symbol.STATIC: 0}
+        self.__kind_count = [0] * len(KIND_SEGMENTS)
 
     def register_symbol(self, name: str, type_of: str, kind: str):
         """
@@ -59,30 +82,32 @@ class SymbolTable:
         :return:
         """
         assert name not in self.__subroutine_table, f'Tried to register name {name}, but it is already registered.'
-        new_symbol = Symbol(name, kind, type_of, self.__kind_count[kind])
-        self.__kind_count[kind] += 1
-        if kind == Symbol.ARGS or kind == Symbol.LOCAL:
+        kind_code = Symbol.KIND_CODES.get(kind)
+        if kind_code is None:
+            raise RuntimeError(f'Unknown kind {kind}')
+        new_symbol = Symbol(name, kind_code, type_of, self.__kind_count[kind_code])
+        self.__kind_count[kind_code] += 1
+        if kind_code == ARGS_CODE or kind_code == LOCAL_CODE:
             self.__subroutine_table[name] = new_symbol
-        elif kind == Symbol.FIELD or kind == Symbol.STATIC:
-            self.__class_table[name] = new_symbol
         else:
-            raise RuntimeError(f'Unknown kind {kind}')
+            self.__class_table[name] = new_symbol
 
     def start_subroutine(self):
         """
         start a new subroutine table
         """
         self.__subroutine_table = {}
-        self.__kind_count[Symbol.ARGS] = 0
-        self.__kind_count[Symbol.LOCAL] = 0
+        self.__kind_count[ARGS_CODE] = 0
+        self.__kind_count[LOCAL_CODE] = 0
 
     def look_up_symbol(self, name: str) -> typing.Union[Symbol, None]:
-        if name in self.__subroutine_table:
-            return self.__subroutine_table[name]
-        elif name in self.__class_table:
-            return self.__class_table[name]
-        else:
-            return None
+        symbol = self.__subroutine_table.get(name)
+        if symbol is None:
+            symbol = self.__class_table.get(name)
+        return symbol
 
     def get_field_num(self) -> int:
-        return len(list(filter(lambda x: (self.__class_table[x].get_segment() == 'this'), self.__class_table.keys())))
+        return self.__kind_count[FIELD_CODE]
+
+    def get_static_num(self) -> int:
+        return self.__kind_count[STATIC_CODE]
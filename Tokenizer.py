@@ -1,68 +1,225 @@
+import collections
+import mmap
 import re
+import typing
 
 KEYWORDS = {'class', 'constructor', 'function', 'method', 'field', 'static', 'var', 'int', 'char', 'boolean',
             'void', 'true', 'false', 'null', 'this', 'let', 'do', 'if', 'else', 'while', 'return'}
 COMMENTS_RE = '\s*(?:\s*(?:(?:\/\*.*?\*\/)|(?:\/\/[^\n]*))\s*)*\s*'
 
-KEYWORD_RE = COMMENTS_RE + "(class|constructor|function|method|field|static|var|int|char|boolean|void|" \
-                           "true|false|null|this|let|do |if|else|while|return)"
+KEYWORD_PATTERN = "(?:class|constructor|function|method|field|static|var|int|char|boolean|void|" \
+                  "true|false|null|this|let|do|if|else|while|return)(?!\w)"
+KEYWORD_RE = COMMENTS_RE + "(" + KEYWORD_PATTERN + ")"
 SYMBOLS = {'{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', '<', '>', '=', '~'}
-SYMBOLS_RE = COMMENTS_RE + "({|}|\(|\)|\[|\]|\.|,|;|\+|-|\*|/|&|\||<|>|=|~)"
+SYMBOLS_PATTERN = "[{}()\[\].,;+\-*/&|<>=~]"
+SYMBOLS_RE = COMMENTS_RE + "(" + SYMBOLS_PATTERN + ")"
 INTEGER_CONSTANT = "integerConstant"
-INTEGER_CONSTANT_RE = COMMENTS_RE + "(\d+)"
+INTEGER_CONSTANT_PATTERN = "\d+"
+INTEGER_CONSTANT_RE = COMMENTS_RE + "(" + INTEGER_CONSTANT_PATTERN + ")"
 STRING_CONSTANT = "stringConstant"
-STRING_CONSTANT_RE = COMMENTS_RE + "(\"[^\"\n]+\")"
+STRING_CONSTANT_PATTERN = "\"[^\"\n]*\""
+STRING_CONSTANT_RE = COMMENTS_RE + "(" + STRING_CONSTANT_PATTERN + ")"
 IDENTIFIER = "identifier"
-IDENTIFIER_RE = COMMENTS_RE + "([a-zA-Z_][\w]*)"
+IDENTIFIER_PATTERN = "[a-zA-Z_]\w*"
+IDENTIFIER_RE = COMMENTS_RE + "(" + IDENTIFIER_PATTERN + ")"
 
 KEYWORD = "keyword"
 SYMBOL = "symbol"
 
-REGEXS = {KEYWORD: re.compile(KEYWORD_RE, flags=re.DOTALL), SYMBOL: re.compile(SYMBOLS_RE, flags=re.DOTALL),
-          INTEGER_CONSTANT: re.compile(INTEGER_CONSTANT_RE, flags=re.DOTALL),
-          STRING_CONSTANT: re.compile(STRING_CONSTANT_RE, flags=re.DOTALL),
-          IDENTIFIER: re.compile(IDENTIFIER_RE, flags=re.DOTALL)}
+SKIP = "skip"
+
+# A single scanner pattern where every alternative is a named group, so one match both finds the next lexeme
+# and tells its type. Whitespace and comments are matched as their own lexeme and skipped by the tokenizer.
+MASTER_PATTERN = "(?P<" + SKIP + ">\\s+|/\\*.*?\\*/|//[^\\n]*)" \
+                 "|(?P<" + KEYWORD + ">" + KEYWORD_PATTERN + ")" \
+                 "|(?P<" + SYMBOL + ">" + SYMBOLS_PATTERN + ")" \
+                 "|(?P<" + INTEGER_CONSTANT + ">" + INTEGER_CONSTANT_PATTERN + ")" \
+                 "|(?P<" + STRING_CONSTANT + ">" + STRING_CONSTANT_PATTERN + ")" \
+                 "|(?P<" + IDENTIFIER + ">" + IDENTIFIER_PATTERN + ")"
+# ASCII matching keeps \s, \d and \w the same over text as over bytes, so both tokenize a source alike.
+MASTER_RE = re.compile(MASTER_PATTERN, flags=re.DOTALL | re.ASCII)
+# The same pattern over bytes, for matching directly against a memory-mapped file.
+MASTER_BYTES_RE = re.compile(MASTER_PATTERN.encode(), flags=re.DOTALL)
+# The encoding of jack sources, whether they are read as text or matched as bytes.
+ENCODING = 'utf-8'
+# The most bytes a single character takes in the encoding.
+MAX_CHAR_BYTES = 4
+
+# Small integer codes of the token types, in the order of their groups in the master pattern.
+KEYWORD_KIND = 0
+SYMBOL_KIND = 1
+INTEGER_CONSTANT_KIND = 2
+STRING_CONSTANT_KIND = 3
+IDENTIFIER_KIND = 4
+KINDS = (KEYWORD, SYMBOL, INTEGER_CONSTANT, STRING_CONSTANT, IDENTIFIER)
+# The index of the skip group, and the offset from the index of a token's group to its kind code.
+SKIP_GROUP = MASTER_RE.groupindex[SKIP]
+KIND_GROUP_OFFSET = MASTER_RE.groupindex[KEYWORD]
+# Keywords and symbols are shared by all their tokens instead of each token holding its own copy of the text.
+INTERNED = {content: content for content in KEYWORDS | SYMBOLS}
 
 
 class Tokenizer:
     """
     Class representing a stream of tokens parsed from a .jack file.
+    Tokens are lexed once into a lookahead buffer, so peeking at upcoming tokens never scans the source again.
     """
 
-    def __init__(self, source_file: str):
+    def __init__(self, source_file: typing.Optional[str], prelex: bool = False, memory_map: bool = False,
+                 source: typing.Union[str, bytes, None] = None):
         """
         Create a tokenizer stream over an input file.
-        :param source_file: input file
+        :param source_file: input file, or None if the source is given.
+        :param prelex: lex the whole file up front instead of lexing tokens as they are needed.
+        :param memory_map: match tokens directly against a read-only memory map of the file instead of reading it
+            into a string. Without prelex only the lookahead tokens are held in memory, whatever the size of the file.
+        :param source: the jack source itself, to tokenize it without reading a file. Bytes are matched as they are,
+            without decoding them first, and only the tokens are decoded, as ENCODING.
         """
         self.__filename = source_file
-        with open(self.__filename, 'r') as file:
-            self.__file = file.read()
+        self.__binary = memory_map or isinstance(source, bytes)
+        self.__master_re = MASTER_BYTES_RE if self.__binary else MASTER_RE
+        if source is not None:
+            self.__file = source
+        elif memory_map:
+            with open(self.__filename, 'rb') as file:
+                try:
+                    self.__file = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                except ValueError:  # Empty files cannot be mapped.
+                    self.__file = b''
+        else:
+            with open(self.__filename, 'r', encoding=ENCODING) as file:
+                self.__file = file.read()
+        self.__offset = 0
+        self.__lookahead = collections.deque()
+        if prelex:
+            self.prelex()
+
+    def close(self):
+        """
+        Release the memory map of the file, if there is one.
+        """
+        if isinstance(self.__file, mmap.mmap):
+            self.__file.close()
+            self.__file = b''
+
+    def __make_token(self, match: re.Match) -> 'Token':
+        end = match.end()
+        kind = match.lastindex - KIND_GROUP_OFFSET
+        if self.__binary:
+            content = match.group().decode(ENCODING)
+            # A token ends on a character boundary, but the character after it may take more than one byte.
+            next_char = self.__file[end:end + MAX_CHAR_BYTES].decode(ENCODING, 'ignore')[:1]
+        else:
+            content = match.group()
+            next_char = self.__file[end:end + 1]
+        if kind <= SYMBOL_KIND:
+            content = INTERNED[content]
+        return Token(content, kind, next_char, match.start())
+
+    def prelex(self):
+        """
+        Lex all the remaining tokens of the source into the lookahead buffer.
+        """
+        scanner = self.__master_re.scanner(self.__file, self.__offset)
+        append = self.__lookahead.append
+        make_token = self.__make_token
+        match = scanner.match()
+        while match:
+            if match.lastindex != SKIP_GROUP:
+                append(make_token(match))
+            match = scanner.match()
+        self.__offset = len(self.__file)
+
+    def __scan(self):
+        """
+        Lex the token at the current offset of the source, without copying the rest of the source.
+        :return: the token, or None if there are no more tokens.
+        """
+        master_re = self.__master_re
+        offset = self.__offset
+        match = master_re.match(self.__file, offset)
+        while match and match.lastindex == SKIP_GROUP:
+            offset = match.end()
+            match = master_re.match(self.__file, offset)
+        if not match:
+            self.__offset = offset
+            return None
+        self.__offset = match.end()
+        return self.__make_token(match)
 
     def next_token(self, cut=True):
         """
-        :return: next token
+        :param cut: whether to advance past the returned token.
+        :return: next token, or None if there are no more tokens.
         """
-        for token in REGEXS:
-            match = REGEXS[token].match(self.__file)
-            if match:
-                token_content = match.group(1)
-                if cut:
-                    self.__file = self.__file[match.span(1)[1]:]
-                next_char = ''
-                if len(self.__file) > match.span(1)[1]:
-                    next_char = self.__file[match.span(1)[1]]
-                return Token(token_content, token, next_char)
+        if not cut:
+            # Methods of the tokenizer call each other directly, so a subclass that counts the calls made to it
+            # counts each of them once.
+            return Tokenizer.peek(self)
+        if self.__lookahead:
+            return self.__lookahead.popleft()
+        return self.__scan()
 
     def has_more_tokens(self):
-        return self.__file is not []
+        return Tokenizer.peek(self) is not None
 
     def eat(self, string: str):
-        token = self.next_token()
+        token = Tokenizer.next_token(self)
         if string != token.get_content():
-            raise RuntimeError("Unexpected token: " + token.get_content() + " , expected token: " + string)
+            raise RuntimeError("Unexpected token: " + token.get_content() + " , expected token: " + string
+                               + f" , at line {self.get_line(token)}")
 
-    def peek(self):
-        return self.next_token(cut=False)
+    def get_line(self, token: 'Token') -> int:
+        """
+        :param token: a token of this tokenizer.
+        :return: the line number of the token in the source, counting from 1.
+        """
+        newline = b'\n' if self.__binary else '\n'
+        # A memory map has no count, so the part before the token is copied, which only happens to report an error.
+        return self.__file[:token.get_offset()].count(newline) + 1
+
+    def peek_block(self) -> typing.List['Token']:
+        """
+        Look at the upcoming tokens up to the '}' that closes the first '{' among them, without consuming them.
+        :return: the tokens, or all the remaining tokens if the block is never closed.
+        """
+        tokens = []
+        depth = 0
+        for token in self.__lookahead:
+            tokens.append(token)
+            if token.get_content() == '{':
+                depth += 1
+            elif token.get_content() == '}':
+                depth -= 1
+                if depth == 0:
+                    return tokens
+        token = self.__scan()
+        while token is not None:
+            self.__lookahead.append(token)
+            tokens.append(token)
+            if token.get_content() == '{':
+                depth += 1
+            elif token.get_content() == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+            token = self.__scan()
+        return tokens
+
+    def peek(self, k: int = 1):
+        """
+        Look at an upcoming token without consuming it.
+        :param k: how many tokens ahead to look, 1 being the next token.
+        :return: the k-th upcoming token, or None if there are fewer tokens left.
+        """
+        lookahead = self.__lookahead
+        while len(lookahead) < k:
+            token = self.__scan()
+            if token is None:
+                return None
+            lookahead.append(token)
+        return lookahead[k - 1]
 
 
 class Token:
@@ -70,10 +227,20 @@ class Token:
     representing a jack token
     """
 
-    def __init__(self, content, type, next_char=""):
+    __slots__ = ('__content', '__kind', '__next_char', '__offset')
+
+    def __init__(self, content, kind, next_char="", offset=0):
+        """
+        Create a new token.
+        :param content: the text of the token.
+        :param kind: the kind code of the token, such as IDENTIFIER_KIND.
+        :param next_char: the character of the source after the token.
+        :param offset: the offset of the token in the source.
+        """
         self.__content = content
-        self.__type = type
+        self.__kind = kind
         self.__next_char = next_char
+        self.__offset = offset
 
     def get_next_char(self):
         return self.__next_char
@@ -81,5 +248,11 @@ class Token:
     def get_content(self):
         return self.__content
 
+    def get_kind(self) -> int:
+        return self.__kind
+
     def get_type(self):
-        return self.__type
+        return KINDS[self.__kind]
+
+    def get_offset(self) -> int:
+        return self.__offset
@@ -0,0 +1,205 @@
+import array
+import typing
+
+# Every VM command is a single integer: its opcode in the low bits, then a small argument, which is the segment of a
+# push or pop and the count of a function or call, then an operand, which is the index of a push or pop and the name
+# of a label, jump, function or call. Commands without an argument or an operand are equal to their opcode, so
+# 'code[i] == ADD' tests for an add command.
+OPCODES = ('push', 'pop', 'add', 'sub', 'neg', 'eq', 'gt', 'lt', 'and', 'or', 'not', 'label', 'goto', 'if-goto',
+           'function', 'call', 'return')
+PUSH, POP, ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT, LABEL, GOTO, IF_GOTO, FUNCTION, CALL, RETURN = range(len(OPCODES))
+SEGMENTS = ('constant', 'argument', 'local', 'static', 'this', 'that', 'pointer', 'temp')
+CONSTANT, ARGUMENT, LOCAL, STATIC, THIS, THAT, POINTER, TEMP = range(len(SEGMENTS))
+OPCODE_BITS = 5
+ARGUMENT_BITS = 16
+OPCODE_MASK = (1 << OPCODE_BITS) - 1
+ARGUMENT_MASK = (1 << ARGUMENT_BITS) - 1
+OPERAND_SHIFT = OPCODE_BITS + ARGUMENT_BITS
+# The bits of a command without its operand, such as a push to some segment.
+COMMAND_MASK = (1 << OPERAND_SHIFT) - 1
+# The array type code of stored code, 64-bit signed integers.
+CODE_TYPE = 'q'
+OPCODE_IDS = {name: opcode for opcode, name in enumerate(OPCODES)}
+SEGMENT_IDS = {name: segment for segment, name in enumerate(SEGMENTS)}
+
+# Names of labels, functions and calls are interned, and commands refer to them by number. The names that are kept
+# are those of the commands that modules keep as constants, and the rest are forgotten between compilations.
+NAMES = []
+NAME_IDS = {}
+KEPT_NAMES = 0
+
+
+def name_id(name: str) -> int:
+    """
+    :return: the number of a name, interning it if it is new.
+    """
+    number = NAME_IDS.get(name)
+    if number is None:
+        number = NAME_IDS[name] = len(NAMES)
+        NAMES.append(name)
+    return number
+
+
+def keep_names():
+    """
+    Keep every name that was interned so far when names are reset, such as those of the constants of a module. It is
+    called by such modules once their constants are made.
+    """
+    global KEPT_NAMES
+    KEPT_NAMES = len(NAMES)
+
+
+def reset_names():
+    """
+    Forget the names that were interned since they were last kept, and the texts of commands, so a long running
+    process does not keep every name it ever compiled. Commands that refer to forgotten names must not be used
+    afterwards.
+    """
+    for name in NAMES[KEPT_NAMES:]:
+        del NAME_IDS[name]
+    del NAMES[KEPT_NAMES:]
+    TEXTS.clear()
+
+
+def get_name_count() -> int:
+    """
+    :return: the number of names that are interned.
+    """
+    return len(NAMES)
+
+
+def command(opcode: int, argument: int = 0, operand: int = 0) -> int:
+    """
+    :return: a command from its parts.
+    """
+    return opcode | argument << OPCODE_BITS | operand << OPERAND_SHIFT
+
+
+def push(segment: int, index: int) -> int:
+    return PUSH | segment << OPCODE_BITS | index << OPERAND_SHIFT
+
+
+def pop(segment: int, index: int) -> int:
+    return POP | segment << OPCODE_BITS | index << OPERAND_SHIFT
+
+
+def push_constant(value: int) -> int:
+    return PUSH | value << OPERAND_SHIFT
+
+
+def label(name: str) -> int:
+    return LABEL | name_id(name) << OPERAND_SHIFT
+
+
+def goto(name: str) -> int:
+    return GOTO | name_id(name) << OPERAND_SHIFT
+
+
+def if_goto(name: str) -> int:
+    return IF_GOTO | name_id(name) << OPERAND_SHIFT
+
+
+def function(name: str, local_count: int) -> int:
+    return FUNCTION | local_count << OPCODE_BITS | name_id(name) << OPERAND_SHIFT
+
+
+def call(name: str, arg_count: int) -> int:
+    return CALL | arg_count << OPCODE_BITS | name_id(name) << OPERAND_SHIFT
+
+
+def argument_of(code: int) -> int:
+    """
+    :return: the segment of a push or pop, or the count of a function or call.
+    """
+    return code >> OPCODE_BITS & ARGUMENT_MASK
+
+
+def operand_of(code: int) -> int:
+    """
+    :return: the index of a push or pop, or the name number of a label, jump, function or call.
+    """
+    return code >> OPERAND_SHIFT
+
+
+def name_of(code: int) -> str:
+    """
+    :return: the name of a label, jump, function or call.
+    """
+    return NAMES[code >> OPERAND_SHIFT]
+
+
+def with_opcode(code: int, opcode: int) -> int:
+    """
+    :return: the command with another opcode, such as the push that matches a pop, or the goto that matches a label.
+    """
+    return code & ~OPCODE_MASK | opcode
+
+
+def constant_of(code: int) -> typing.Optional[int]:
+    """
+    :return: the value a command pushes if it is a 'push constant', else None.
+    """
+    return code >> OPERAND_SHIFT if code & COMMAND_MASK == PUSH else None
+
+
+def jump_target(code: int) -> typing.Optional[int]:
+    """
+    :return: the name number of the label a goto or if-goto command jumps to, or None for any other command.
+    """
+    opcode = code & OPCODE_MASK
+    return code >> OPERAND_SHIFT if opcode == GOTO or opcode == IF_GOTO else None
+
+
+class Texts(dict):
+    """
+    The text of every command that was serialized so far, by command. A missing command is formatted and kept.
+    """
+
+    def __missing__(self, code: int) -> str:
+        opcode = code & OPCODE_MASK
+        if opcode == PUSH or opcode == POP:
+            text = f'{OPCODES[opcode]} {SEGMENTS[argument_of(code)]} {operand_of(code)}'
+        elif opcode == FUNCTION or opcode == CALL:
+            text = f'{OPCODES[opcode]} {name_of(code)} {argument_of(code)}'
+        elif opcode == LABEL:
+            # Labels are indented by two spaces, like the rest of the compiler always wrote them.
+            text = f'label  {name_of(code)}'
+        elif opcode == GOTO or opcode == IF_GOTO:
+            text = f'{OPCODES[opcode]} {name_of(code)}'
+        else:
+            text = OPCODES[opcode]
+        self[code] = text
+        return text
+
+
+TEXTS = Texts()
+
+
+def serialize(code: typing.Iterable[int]) -> str:
+    """
+    :return: the text of VM commands, separated by newlines.
+    """
+    return '\n'.join(map(TEXTS.__getitem__, code))
+
+
+def parse(text: str) -> int:
+    """
+    :param text: a VM command, such as 'push local 2'.
+    :return: the command.
+    """
+    parts = text.split()
+    opcode = OPCODE_IDS[parts[0]]
+    if opcode == PUSH or opcode == POP:
+        return command(opcode, SEGMENT_IDS[parts[1]], int(parts[2]))
+    if opcode == FUNCTION or opcode == CALL:
+        return command(opcode, int(parts[2]), name_id(parts[1]))
+    if opcode == LABEL or opcode == GOTO or opcode == IF_GOTO:
+        return command(opcode, 0, name_id(parts[1]))
+    return opcode
+
+
+def to_array(code: typing.Iterable[int]) -> array.array:
+    """
+    :return: the commands packed in an array, to be kept compactly.
+    """
+    return array.array(CODE_TYPE, code)
@@ -1,29 +1,189 @@
+from ConstantFolder import ConstantFolder
+from CostReport import CostReport
+from ControlFlowOptimizer import ControlFlowOptimizer, is_boolean, negate_condition
+from PeepholeOptimizer import PeepholeOptimizer
 from SymbolTable import SymbolTable, Symbol
+from VMCode import PUSH, ADD, SUB, NEG, EQ, GT, LT, AND, OR, NOT, RETURN, STATIC, POINTER, TEMP, THAT, ARGUMENT, \
+    label as label_command, push, pop, push_constant, goto, if_goto, function, call, serialize, \
+    OPERAND_SHIFT, OPCODE_MASK, CALL, keep_names
 import typing
 
+# Names of the generated function that builds a class's pooled strings, and of the static that records it ran.
+# '$' cannot appear in Jack identifiers, so they never clash with user code.
+STRING_POOL_INIT = '$strings'
+STRING_POOL_READY_LABEL = 'STRINGS_READY'
+# The words of RAM that hold the statics of all the classes of a program, 16 to 255.
+STATIC_BUDGET = 240
+# The commands of the arithmetic and logical operators of Jack.
+BINARY_OPS = {'+': ADD, '-': SUB, '&': AND, '|': OR, '<': LT, '>': GT, '=': EQ}
+MULTIPLY = call('Math.multiply', 2)
+DIVIDE = call('Math.divide', 2)
+STRING_NEW = call('String.new', 1)
+STRING_APPEND_CHAR = call('String.appendChar', 2)
+MEMORY_ALLOC = call('Memory.alloc', 1)
+keep_names()
+PUSH_THIS = push(POINTER, 0)
+POP_THIS = pop(POINTER, 0)
+POP_THAT = pop(POINTER, 1)
+PUSH_TEMP = push(TEMP, 0)
+POP_TEMP = pop(TEMP, 0)
+PUSH_ARGUMENT = push(ARGUMENT, 0)
+
 
 class VMWriter:
+    """
+    Write VM commands either into a list of lines or, one subroutine at a time, into a text sink. Commands are kept
+    in the compact form of VMCode until they are written to the sink, so optimizers never parse text.
+    """
 
-    def __init__(self):
+    def __init__(self, sink: typing.Optional[typing.TextIO] = None, optimizer: PeepholeOptimizer = None,
+                 folder: ConstantFolder = None, string_pool: bool = False,
+                 flow_optimizer: ControlFlowOptimizer = None, cost_report: CostReport = None):
+        """
+        Create a new VM writer.
+        :param sink: a text stream, such as a file, sys.stdout or io.StringIO, that flushed subroutines are written
+            to. Without a sink every line is kept in memory.
+        :param optimizer: a peephole optimizer to run over the lines when they are flushed.
+        :param folder: a constant folder to simplify binary operations with.
+        :param string_pool: build each distinct string literal of the class once and keep it in a static, instead of
+            building a new string every time the literal is evaluated. A subroutine that uses pooled strings first
+            checks that the pool was built. Pooled strings are shared, so they must not be changed or disposed.
+        :param flow_optimizer: a control flow optimizer to run over the lines when they are flushed, before the
+            peephole optimizer.
+        :param cost_report: a report to add the cost of every subroutine to as it is flushed.
+        """
         self.__lines = []
+        # The index in the current subroutine of the last command that may change pointer 1, which is a call or
+        # 'pop pointer 1', so keeps_that does not look at the commands again.
+        self.__that_changed = -1
+        self.__flushed_lines = []
         self.__symbol_table = SymbolTable()
+        self.__sink = sink
+        self.__optimizer = optimizer
+        self.__folder = folder
+        self.__flow_optimizer = flow_optimizer
+        self.__cost_report = cost_report
+        self.__string_pool = {} if string_pool else None
+        self.__uses_string_pool = False
+        self.__func_name = ''
+        self.__written = False
+
+    def get_lines(self) -> typing.List[int]:
+        """
+        :return: the commands that were not written to the sink, which is all of them if there is no sink.
+        """
+        return self.__flushed_lines + self.__lines
+
+    def flush(self) -> typing.List[int]:
+        """
+        Optimize the buffered commands and write them to the sink, as text separated by newlines like the lines of a
+        whole file.
+        :return: the commands that were written.
+        """
+        if not self.__lines:
+            return []
+        lines = self.__lines
+        self.__lines = []
+        self.__that_changed = -1
+        if self.__uses_string_pool:
+            lines[1:1] = self.__string_pool_check()
+            self.__uses_string_pool = False
+        if self.__flow_optimizer is not None:
+            lines = self.__flow_optimizer.optimize(lines)
+        if self.__optimizer is not None:
+            lines = self.__optimizer.optimize(lines)
+        self.__write(lines)
+        return lines
+
+    def write_flushed(self, lines: typing.Sequence[int]):
+        """
+        Write commands that were already flushed by a previous compilation, without optimizing them again.
+        """
+        self.flush()
+        self.__write(lines)
 
-    def get_lines(self) -> typing.List[str]:
-        return self.__lines
+    def __write(self, lines: typing.Sequence[int]):
+        if self.__cost_report is not None:
+            self.__cost_report.add(lines)
+        if self.__sink is None:
+            self.__flushed_lines += lines
+        elif lines:
+            text = serialize(lines)
+            self.__sink.write('\n' + text if self.__written else text)
+            self.__written = True
 
     def write_push_var(self, name: str):
-        var = self.__symbol_table.look_up_symbol(name)
-        self.__lines.append(f'push {var.get_segment()} {str(var.get_index())}')
+        self.__lines.append(self.__symbol_table.look_up_symbol(name).get_push_command())
 
     def write_push_int_constant(self, constant: str):
-        self.__lines.append(f'push constant {constant}')
+        self.__lines.append(int(constant) << OPERAND_SHIFT | PUSH)
 
     def write_push_string_constant(self, constant: str):
-        self.write_push_int_constant(str(len(constant)))
-        self.__lines.append('call String.new 1')
+        if self.__string_pool is not None:
+            if constant not in self.__string_pool:
+                if not self.__has_pool_room():
+                    # The class has no statics left for more pooled strings, so the rest are built every time.
+                    self.__write_build_string(constant)
+                    return
+                self.__string_pool[constant] = self.__register_pool_static(f'${len(self.__string_pool)}')
+            self.__lines.append(push(STATIC, self.__string_pool[constant]))
+            self.__uses_string_pool = True
+            return
+        self.__write_build_string(constant)
+
+    def __write_build_string(self, constant: str):
+        lines = self.__lines
+        lines.append(push_constant(len(constant)))
+        lines.append(STRING_NEW)
         for char in constant:
-            self.write_push_int_constant(str(ord(char)))
-            self.__lines.append('call String.appendChar 2')
+            lines.append(push_constant(ord(char)))
+            lines.append(STRING_APPEND_CHAR)
+        self.__change_that()
+
+    def __has_pool_room(self) -> bool:
+        """
+        :return: whether another string can be pooled without the statics of the class, including the one that records
+            that the pool was built, passing the static budget. The budget is shared by all the classes of a program,
+            which are only checked together once they are compiled.
+        """
+        ready = 0 if self.__symbol_table.look_up_symbol(STRING_POOL_INIT) is not None else 1
+        return self.__symbol_table.get_static_num() + ready < STATIC_BUDGET
+
+    def __register_pool_static(self, name: str) -> int:
+        """
+        Register a hidden static for the string pool.
+        :return: the index of the static.
+        """
+        self.__symbol_table.register_symbol(name, 'String', Symbol.STATIC)
+        return self.__symbol_table.look_up_symbol(name).get_index()
+
+    def __string_pool_check(self) -> typing.List[int]:
+        """
+        :return: the commands that build the pool of the class if it was not built yet.
+        """
+        ready = self.__symbol_table.look_up_symbol(STRING_POOL_INIT)
+        if ready is None:
+            self.__register_pool_static(STRING_POOL_INIT)
+            ready = self.__symbol_table.look_up_symbol(STRING_POOL_INIT)
+        class_name = self.__func_name.split('.')[0]
+        return [push(STATIC, ready.get_index()), if_goto(STRING_POOL_READY_LABEL),
+                call(f'{class_name}.{STRING_POOL_INIT}', 0), POP_TEMP, label_command(STRING_POOL_READY_LABEL)]
+
+    def write_string_pool(self, class_name: str):
+        """
+        Write the function that builds every pooled string of the class, if any string was pooled.
+        :param class_name: name of the class.
+        """
+        if not self.__string_pool:
+            return
+        self.__lines.append(function(f'{class_name}.{STRING_POOL_INIT}', 0))
+        for constant, index in self.__string_pool.items():
+            self.__write_build_string(constant)
+            self.__lines.append(pop(STATIC, index))
+        self.write_push_keyword_constant('true')
+        self.__lines.append(pop(STATIC, self.__symbol_table.look_up_symbol(STRING_POOL_INIT).get_index()))
+        self.write_push_int_constant('0')
+        self.write_return()
 
     def is_object(self, name: str):
         symbol = self.__symbol_table.look_up_symbol(name)
@@ -34,7 +194,7 @@ class VMWriter:
         if keyword == 'null' or keyword == 'false':
             self.write_push_int_constant('0')
         elif keyword == 'this':
-            self.__lines.append('push pointer 0')
+            self.__lines.append(PUSH_THIS)
         elif keyword == 'true':
             self.write_push_int_constant('0')
             self.write_arithmetic('~', unary=True)
@@ -43,79 +203,166 @@ class VMWriter:
 
     def write_constructor_alloc(self):
         size = self.__symbol_table.get_field_num()
-        self.write_push_int_constant(str(size))
-        self.__lines.append(f'call Memory.alloc 1')
-        self.__lines.append('pop pointer 0')
+        self.__lines.append(push_constant(size))
+        self.__lines.append(MEMORY_ALLOC)
+        self.__change_that()
+        self.__lines.append(POP_THIS)
 
     def write_set_this(self):
-        self.__lines.append('push argument 0')
-        self.__lines.append('pop pointer 0')
+        self.__lines.append(PUSH_ARGUMENT)
+        self.__lines.append(POP_THIS)
 
     def write_pop_var(self, var_name: str):
         var = self.__symbol_table.look_up_symbol(var_name)
         assert var is not None, f'Name {var_name} is undefined.'
-        self.__lines.append(f'pop {var.get_segment()} {str(var.get_index())}')
+        self.__lines.append(var.get_pop_command())
 
     def write_pop_temp(self):
-        self.__lines.append('pop temp 0')
+        self.__lines.append(POP_TEMP)
 
     def write_arithmetic(self, op: str, unary=False):
         if op == '~':
-            self.__lines.append('not')
-        elif op == '+':
-            self.__lines.append('add')
-        elif op == '-':
-            if unary:
-                self.__lines.append('neg')
-            else:
-                self.__lines.append('sub')
-        elif op == '&':
-            self.__lines.append('and')
-        elif op == '|':
-            self.__lines.append('or')
-        elif op == '<':
-            self.__lines.append('lt')
-        elif op == '>':
-            self.__lines.append('gt')
-        elif op == '=':
-            self.__lines.append('eq')
+            self.__lines.append(NOT)
+        elif op == '-' and unary:
+            self.__lines.append(NEG)
+        elif op in BINARY_OPS:
+            self.__lines.append(BINARY_OPS[op])
         elif op == '*':
-            self.__lines.append('call Math.multiply 2')
+            self.__lines.append(MULTIPLY)
+            self.__change_that()
         elif op == '/':
-            self.__lines.append('call Math.divide 2')
+            self.__lines.append(DIVIDE)
+            self.__change_that()
+
+    def mark(self) -> int:
+        """
+        :return: a position in the current subroutine, marking where the code of an operand starts.
+        """
+        return len(self.__lines)
+
+    def take(self, mark: int) -> typing.List[int]:
+        """
+        Remove the lines written since a mark in the current subroutine.
+        :return: the removed lines.
+        """
+        lines = self.__lines[mark:]
+        del self.__lines[mark:]
+        if self.__that_changed >= mark:
+            # Only the last change is recorded, so a change before the mark is assumed to be right before it.
+            self.__that_changed = mark - 1
+        return lines
+
+    def write_lines(self, lines: typing.List[int]):
+        """
+        Write lines that were taken from the current subroutine.
+        """
+        start = len(self.__lines)
+        self.__lines += lines
+        for index in range(len(lines) - 1, -1, -1):
+            if lines[index] == POP_THAT or lines[index] & OPCODE_MASK == CALL:
+                self.__that_changed = start + index
+                break
+
+    def constant_value(self, mark: int) -> typing.Optional[int]:
+        """
+        :return: the value of the expression written since a mark, if it is a constant, else None.
+        """
+        return ConstantFolder.constant_value(self.__lines, mark)
+
+    def is_boolean(self, mark: int) -> bool:
+        """
+        :return: whether the expression written since a mark is known to be either true or false.
+        """
+        return is_boolean(self.__lines, mark)
+
+    def negate_condition(self, mark: int) -> bool:
+        """
+        Negate the condition written since a mark, if that can be done without adding a 'not' command.
+        :return: whether the condition was negated.
+        """
+        return negate_condition(self.__lines, mark)
+
+    def write_binary_arithmetic(self, op: str, left: int, right: int):
+        """
+        Write a binary operation, folding it at compile time if possible.
+        :param op: the operator.
+        :param left: mark of the start of the left operand's code.
+        :param right: mark of the start of the right operand's code.
+        """
+        if self.__folder is None or not self.__folder.fold(self.__lines, op, left, right):
+            self.write_arithmetic(op)
+        elif self.__that_changed >= right:
+            # A constant has no calls, so the left operand was a constant that the fold dropped from before the
+            # right operand.
+            self.__that_changed -= right - left
 
     def write_call(self, func_name: str, arg_num: int):
-        self.__lines.append(f'call {func_name} {str(arg_num)}')
+        self.__lines.append(call(func_name, arg_num))
+        self.__change_that()
 
     def write_if_goto(self, label: str):
-        self.__lines.append('if-goto ' + label)
+        self.__lines.append(if_goto(label))
 
     def write_goto(self, label: str):
-        self.__lines.append('goto ' + label)
+        self.__lines.append(goto(label))
 
     def write_label(self, label: str):
-        self.__lines.append('label  ' + label)
+        self.__lines.append(label_command(label))
 
     def write_return(self):
-        self.__lines.append('return')
+        self.__lines.append(RETURN)
 
     def declare_func(self, func_name: str, args: typing.List[typing.Tuple[str, str]], num_vars: int):
-        self.__lines.append(f'function {func_name} {num_vars}')
+        self.__lines.append(function(func_name, num_vars))
+        self.__func_name = func_name
         for arg in args:
             self.__symbol_table.register_symbol(arg[0], arg[1], Symbol.ARGS)
 
     def declare_var(self, name: str, kind: str, type_of: str):
         self.__symbol_table.register_symbol(name, type_of, kind)
 
-    def write_access_array(self):
-        self.__lines.append('pop temp 0')
-        self.__lines.append('pop pointer 1')
-        self.__lines.append('push temp 0')
-        self.__lines.append('pop that 0')
+    def write_access_array(self, index: int = 0):
+        """
+        Pop the value on top of the stack into an array element, whose address is below it.
+        :param index: the offset of the element from the address.
+        """
+        self.__lines.append(POP_TEMP)
+        self.__lines.append(POP_THAT)
+        self.__change_that()
+        self.__lines.append(PUSH_TEMP)
+        self.__lines.append(pop(THAT, index))
+
+    def write_get_array(self, index: int = 0):
+        """
+        Push an array element, whose address is on top of the stack.
+        :param index: the offset of the element from the address.
+        """
+        self.__lines.append(POP_THAT)
+        self.__change_that()
+        self.__lines.append(push(THAT, index))
+
+    def write_set_that(self, mark: int):
+        """
+        Point the that segment at the address that is on top of the stack at a mark, before the code written since.
+        """
+        self.__lines.insert(mark, POP_THAT)
+        self.__that_changed = self.__that_changed + 1 if self.__that_changed >= mark else mark
+
+    def write_pop_that(self, index: int):
+        self.__lines.append(pop(THAT, index))
+
+    def keeps_that(self, mark: int) -> bool:
+        """
+        :return: whether the code written since a mark cannot change pointer 1. Calls are assumed to change it,
+        since their code may be inlined.
+        """
+        return self.__that_changed < mark
 
-    def write_get_array(self):
-        self.__lines.append('pop pointer 1')
-        self.__lines.append('push that 0')
+    def __change_that(self):
+        """
+        Record that the last command written may change pointer 1.
+        """
+        self.__that_changed = len(self.__lines) - 1
 
     def start_subroutine(self):
         self.__symbol_table.start_subroutine()
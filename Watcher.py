@@ -0,0 +1,115 @@
+import contextlib
+import io
+import os
+import sys
+import time
+import typing
+
+from BuildCache import BuildCache
+from CompileOptions import CompileOptions
+from FileHandler import FileHandler
+from SubroutineCache import SubroutineCache
+from VMCode import get_name_count, reset_names
+
+DEFAULT_INTERVAL = 0.5
+# The number of interned names past which they are reset between compilations, together with the cached
+# subroutines that refer to them.
+MAX_NAMES = 1 << 16
+
+
+class Watcher:
+    """
+    Keep compiling the .jack files of a directory whenever they change, in a single long running process. The code
+    of every subroutine is kept, so a change to one subroutine only compiles that subroutine again, and the .vm
+    file is still exactly what a full compilation would write.
+    """
+
+    def __init__(self, source_dir: str, options: CompileOptions, cache: typing.Optional[BuildCache] = None,
+                 file_name: typing.Optional[str] = None, interval: float = DEFAULT_INTERVAL):
+        """
+        Create a new watcher.
+        :param source_dir: the directory to watch.
+        :param options: options to compile with. Subroutines are not reused when strings are pooled.
+        :param cache: build cache of the directory, updated after every compilation.
+        :param file_name: a single .jack file of the directory to watch, instead of all of them.
+        :param interval: seconds to wait between checks for changed files.
+        """
+        self.__source_dir = source_dir
+        self.__options = options
+        self.__cache = cache
+        self.__file_name = file_name
+        self.__interval = interval
+        self.__states = {}
+        self.__subroutine_caches = {}
+
+    def __list_files(self) -> typing.List[str]:
+        if self.__file_name is not None:
+            return [self.__file_name]
+        return sorted(file for file in os.listdir(self.__source_dir) if file[-5:] == '.jack')
+
+    def poll(self) -> typing.List[str]:
+        """
+        Check which files changed since the last check, by their modification time and size.
+        :return: the names of the new and changed files.
+        """
+        changed = []
+        states = {}
+        for file in self.__list_files():
+            try:
+                stat = os.stat(os.path.join(self.__source_dir, file))
+            except FileNotFoundError:
+                continue
+            states[file] = (stat.st_mtime_ns, stat.st_size)
+            if self.__states.get(file) != states[file]:
+                changed.append(file)
+        for file in set(self.__subroutine_caches) - set(states):
+            del self.__subroutine_caches[file]
+        self.__states = states
+        return changed
+
+    def compile(self, file: str) -> bool:
+        """
+        Compile a single file, reusing the code of its unchanged subroutines, and report the result.
+        :param file: name of the .jack file.
+        :return: whether the file compiled successfully.
+        """
+        subroutine_cache = self.__subroutine_caches.setdefault(file, SubroutineCache())
+        output = io.StringIO()
+        error = None
+        with contextlib.redirect_stdout(output):
+            try:
+                FileHandler(file, self.__source_dir, options=self.__options,
+                            subroutine_cache=subroutine_cache).compile()
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+        print(output.getvalue(), end='')
+        if error is not None:
+            print(f'{file}: {error}', file=sys.stderr)
+        else:
+            compiled = subroutine_cache.get_hits() + subroutine_cache.get_misses()
+            print(f'{file}: compiled {subroutine_cache.get_misses()} of {compiled} subroutines.')
+        success = error is None and not output.getvalue()
+        if self.__cache is not None:
+            if success:
+                self.__cache.update(file)
+            else:
+                self.__cache.invalidate(file)
+        return success
+
+    def run(self):
+        """
+        Compile the files, then keep compiling them as they change, until interrupted.
+        """
+        try:
+            while True:
+                changed = self.poll()
+                for file in changed:
+                    self.compile(file)
+                if changed and self.__cache is not None:
+                    self.__cache.save()
+                if get_name_count() > MAX_NAMES:
+                    reset_names()
+                    self.__subroutine_caches.clear()
+                time.sleep(self.__interval)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,106 @@
+import typing
+
+INDENT = '  '
+
+
+class StreamedElement:
+    """
+    A node of a parse tree that is written by an XmlStream. It stands in for an lxml element while it is open: its
+    text can be set before it has children, and its children can be counted.
+    """
+
+    def __init__(self, stream: typing.Optional['XmlStream'], depth: int):
+        """
+        Create a new streamed element.
+        :param stream: the stream that writes the element, or None for the root, which is not written.
+        :param depth: the depth of the element, 0 for the root.
+        """
+        self.__stream = stream
+        self.__depth = depth
+        self.__children = 0
+
+    def get_depth(self) -> int:
+        return self.__depth
+
+    def add_child(self):
+        self.__children += 1
+
+    def __len__(self) -> int:
+        return self.__children
+
+    @property
+    def text(self) -> None:
+        # The text was already written, and is not kept.
+        return None
+
+    @text.setter
+    def text(self, text: str):
+        self.__stream.write_text(text)
+
+
+class XmlStream:
+    """
+    Write a parse tree to an XML file as it is built, with lxml's incremental writer, instead of holding the tree in
+    memory. Nodes are added in document order, so adding a node to an element finishes the nodes that were opened
+    inside it, and only the path from the root to the last node is ever open.
+    """
+
+    def __init__(self, file_name: str):
+        """
+        Create a new XML stream. It is written when it is entered as a context manager.
+        :param file_name: the XML file to write.
+        """
+        from lxml import etree
+        self.__xml_file_context = etree.xmlfile(file_name, encoding='utf-8')
+        self.__xml_file = None
+        self.__root = StreamedElement(None, 0)
+        # The open elements with the contexts that write their end tags, the deepest last.
+        self.__open_elements = []
+
+    def __enter__(self) -> 'XmlStream':
+        self.__xml_file = self.__xml_file_context.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.__finish(self.__root)
+        return self.__xml_file_context.__exit__(exc_type, exc_value, traceback)
+
+    def get_root(self) -> StreamedElement:
+        """
+        :return: the element the tree is added to, which is not written itself.
+        """
+        return self.__root
+
+    def add(self, parent: StreamedElement, tag: str) -> StreamedElement:
+        """
+        Add a node to the tree and write its start tag. Its end tag is written once a node is added outside it.
+        :param parent: the element to add the node to, which must be open.
+        :param tag: tag of the node.
+        :return: the new node.
+        """
+        self.__finish(parent)
+        parent.add_child()
+        if parent is not self.__root:
+            self.__xml_file.write('\n' + INDENT * parent.get_depth())
+        context = self.__xml_file.element(tag)
+        context.__enter__()
+        element = StreamedElement(self, parent.get_depth() + 1)
+        self.__open_elements.append((element, context))
+        return element
+
+    def write_text(self, text: str):
+        """
+        Write text into the last node that was added.
+        """
+        self.__xml_file.write(text)
+
+    def __finish(self, element: StreamedElement):
+        """
+        Write the end tags of the nodes that are open inside an element.
+        """
+        while self.__open_elements and self.__open_elements[-1][0] is not element:
+            finished, context = self.__open_elements.pop()
+            if len(finished):
+                self.__xml_file.write('\n' + INDENT * (finished.get_depth() - 1))
+            context.__exit__(None, None, None)